@@ -0,0 +1,80 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+# OrderedBatchPool groups submitted items into batches and runs `fn` over each batch
+# in a process pool. Results are handed to `on_result(batch, results)` in submission
+# order, so writers downstream keep the same row order as the serial version.
+# `payload(item)` selects what is sent to the workers, by default the whole item.
+# With workers=0 everything runs inline, which is useful for debugging.
+class OrderedBatchPool:
+    def __init__(
+        self,
+        fn,
+        on_result,
+        workers: int | None = None,
+        batch_size: int = 1000,
+        max_pending: int | None = None,
+        initializer=None,
+        initargs=(),
+        mp_context=None,
+        payload=None,
+    ):
+        self.fn = fn
+        self.payload = payload
+        self.on_result = on_result
+        self.batch_size = batch_size
+        self.workers = os.cpu_count() if workers is None else workers
+        # bounds memory: at most max_pending batches are in flight at once
+        self.max_pending = max_pending or max(2 * self.workers, 1)
+        self._batch = []
+        self._pending = deque()
+        self._executor = None
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=mp_context,
+                initializer=initializer,
+                initargs=initargs,
+            )
+        elif initializer is not None:
+            initializer(*initargs)
+
+    def submit(self, item):
+        self._batch.append(item)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            batch, self._batch = self._batch, []
+            args = batch if self.payload is None else [self.payload(i) for i in batch]
+            if self._executor is None:
+                self.on_result(batch, self.fn(args))
+            else:
+                self._pending.append((batch, self._executor.submit(self.fn, args)))
+        self._drain()
+
+    def _drain(self, wait_all: bool = False):
+        while self._pending and (
+            wait_all
+            or len(self._pending) > self.max_pending
+            or self._pending[0][1].done()
+        ):
+            batch, future = self._pending.popleft()
+            self.on_result(batch, future.result())
+
+    def close(self):
+        try:
+            self.flush()
+            self._drain(wait_all=True)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,388 @@
+import glob
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import orjson
+import pygit2
+
+from columnar_io import BatchedWriter, COMMITS_SCHEMA
+from parse_attributions import extract_attributions
+
+DEBUG = os.getenv("DEBUG", "false")
+level = logging.INFO
+if DEBUG != "false":
+    level = logging.DEBUG
+
+logging.basicConfig(
+    level=level,
+    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+# shape of the synthetic repository
+BENCH_COMMITS = int(os.getenv("BENCH_COMMITS", "20000"))
+BENCH_MERGE_RATIO = float(os.getenv("BENCH_MERGE_RATIO", "0.05"))
+# share of the commits changing MAINTAINERS
+BENCH_MAINTAINERS_RATIO = float(os.getenv("BENCH_MAINTAINERS_RATIO", "0.02"))
+BENCH_CONTRIBUTORS = int(os.getenv("BENCH_CONTRIBUTORS", "500"))
+BENCH_SEED = int(os.getenv("BENCH_SEED", "1"))
+# relative slowdown reported as a regression against the previous run of the same shape
+BENCH_TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.2"))
+
+BENCH_DIR = os.path.abspath("./data/benchmarks")
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# stages run against the synthetic repository, in order
+STAGES = [
+    ("enrich", "enrich_from_git.py"),
+    ("maintainers", "get_official_kernel_maintainers.py"),
+    ("stitch", "stitch_data_into_final_payload.py"),
+]
+
+SUBSYSTEMS = {
+    "DRM DRIVERS": "drivers/gpu/drm",
+    "EXT4 FILE SYSTEM": "fs/ext4",
+    "NETWORKING [GENERAL]": "net/core",
+    "SCHEDULER": "kernel/sched",
+    "MEMORY MANAGEMENT": "mm",
+    "USB SUBSYSTEM": "drivers/usb/core",
+    "SOUND": "sound/core",
+    "X86 ARCHITECTURE": "arch/x86/kernel",
+}
+
+# the attribution types seen in the kernel history, typos included
+TRAILERS = [
+    ("Reviewed-by", 30),
+    ("Acked-by", 15),
+    ("Tested-by", 8),
+    ("Reported-by", 8),
+    ("Suggested-by", 4),
+    ("Co-developed-by", 3),
+    ("Reviwed-by", 1),
+    ("Reported-and-tested-by", 1),
+]
+
+
+class SyntheticKernel:
+    """
+    Generates a bare repository shaped like the kernel history: subsystem directories,
+    merges of side branches, trailer rich messages, release tags and a MAINTAINERS file
+    gaining and losing entries over time. Built with an in-memory index, nothing is
+    checked out.
+    """
+
+    def __init__(self, path: str, seed: int = BENCH_SEED):
+        self.rng = random.Random(seed)
+        self.repo = pygit2.init_repository(path, bare=True)
+        self.index = pygit2.Index()
+        self.files = {}
+        self.people = [
+            (
+                f"Developer {i}",
+                f"dev{i}@{self.rng.choice(['kernel.org', 'example.com'])}",
+            )
+            for i in range(BENCH_CONTRIBUTORS)
+        ]
+        # every section starts with a couple of maintainers
+        self.maintainers = {
+            section: {self.rng.choice(self.people) for _ in range(2)}
+            for section in SUBSYSTEMS
+        }
+        self.time = int(datetime(2005, 4, 16, tzinfo=timezone.utc).timestamp())
+
+    def maintainers_file(self) -> bytes:
+        lines = ["List of maintainers", "===================", ""]
+        for section, directory in sorted(SUBSYSTEMS.items()):
+            lines.append(section)
+            lines += [
+                f"M:\t{name} <{email}>"
+                for name, email in sorted(self.maintainers[section])
+            ]
+            lines += [
+                "L:\tlinux-kernel@vger.kernel.org",
+                "S:\tMaintained",
+                f"F:\t{directory}/",
+                "",
+            ]
+        return "\n".join(lines).encode()
+
+    def write(self, path: str, content: bytes):
+        self.index.add(
+            pygit2.IndexEntry(
+                path, self.repo.create_blob(content), pygit2.GIT_FILEMODE_BLOB
+            )
+        )
+
+    def change_file(self, path: str):
+        lines = self.files.setdefault(path, [])
+        # drops a few lines and adds some more, like a patch would
+        for _ in range(min(len(lines), self.rng.randint(0, 10))):
+            lines.pop(self.rng.randrange(len(lines)))
+        for _ in range(self.rng.randint(1, 40)):
+            lines.insert(
+                self.rng.randint(0, len(lines)),
+                f"\tstatement_{self.rng.randint(0, 1 << 20)}();",
+            )
+        self.write(path, "\n".join(lines).encode() + b"\n")
+
+    def change_maintainers(self):
+        section = self.rng.choice(list(SUBSYSTEMS))
+        entries = self.maintainers[section]
+        if len(entries) > 1 and self.rng.random() < 0.4:
+            entries.discard(self.rng.choice(sorted(entries)))
+        else:
+            entries.add(self.rng.choice(self.people))
+        self.write("MAINTAINERS", self.maintainers_file())
+
+    def message(self, subsystem: str, author: tuple, committer: tuple) -> str:
+        lines = [f"{subsystem}: change number {self.rng.randint(0, 1 << 30)}", ""]
+        lines += [
+            "Body of the change, explaining why it is needed."
+        ] * self.rng.randint(1, 6)
+        lines.append("")
+        if self.rng.random() < 0.05:
+            # a few commits without any attribution
+            return "\n".join(lines)
+        for trailer, weight in TRAILERS:
+            if self.rng.randint(0, 100) < weight:
+                name, email = self.rng.choice(self.people)
+                lines.append(f"{trailer}: {name} <{email}>")
+        lines.append(f"Signed-off-by: {author[0]} <{author[1]}>")
+        if committer != author:
+            lines.append(f"Signed-off-by: {committer[0]} <{committer[1]}>")
+        lines.append(
+            f"Link: https://lore.kernel.org/r/{self.rng.randint(0, 1 << 40)}@example.com"
+        )
+        return "\n".join(lines) + "\n"
+
+    def commit(self, parents: list) -> pygit2.Oid:
+        self.time += self.rng.randint(60, 3 * 3600)
+        section = self.rng.choice(list(SUBSYSTEMS))
+        for _ in range(self.rng.randint(1, 5)):
+            self.change_file(f"{SUBSYSTEMS[section]}/file_{self.rng.randint(0, 30)}.c")
+        if self.rng.random() < BENCH_MAINTAINERS_RATIO:
+            self.change_maintainers()
+
+        author = self.rng.choice(self.people)
+        committer = self.rng.choice(self.people[:50])
+        return self.repo.create_commit(
+            None,
+            pygit2.Signature(
+                author[0], author[1], self.time - self.rng.randint(0, 86400), 0
+            ),
+            pygit2.Signature(committer[0], committer[1], self.time, 0),
+            self.message(section.split()[0].lower(), author, committer),
+            self.index.write_tree(self.repo),
+            parents,
+        )
+
+    def generate(self, commits: int) -> pygit2.Oid:
+        self.write("MAINTAINERS", self.maintainers_file())
+        head = self.commit([])
+        generated = 1
+        release = 0
+        while generated < commits:
+            if generated > 2 and self.rng.random() < BENCH_MERGE_RATIO:
+                # a side branch forked from the parent, merged back into the mainline
+                side = self.commit([self.repo[head].parents[0].id])
+                head = self.commit([head, side])
+                generated += 2
+            else:
+                head = self.commit([head])
+                generated += 1
+            if generated // 1000 > release:
+                release = generated // 1000
+                self.repo.references.create(f"refs/tags/v1.{release}", head)
+
+        self.repo.references.create("refs/heads/master", head)
+        self.repo.set_head("refs/heads/master")
+        return head
+
+
+def synthetic_repository() -> tuple[str, str]:
+    """(shape, path) of the repository of the BENCH_* shape, generated on first use"""
+    # the repository only depends on its shape, it is generated once and reused
+    shape = f"{BENCH_COMMITS}-{BENCH_MERGE_RATIO}-{BENCH_MAINTAINERS_RATIO}-{BENCH_CONTRIBUTORS}-{BENCH_SEED}"
+    repo_path = os.path.join(BENCH_DIR, "repos", f"linux-{shape}.git")
+    if not os.path.exists(repo_path):
+        logging.info(f"generating {BENCH_COMMITS} commits in {repo_path}")
+        start = time.perf_counter()
+        SyntheticKernel(repo_path).generate(BENCH_COMMITS)
+        logging.info(f"generated in {time.perf_counter() - start:.1f}s")
+    return shape, repo_path
+
+
+def write_commits_dataset(repo: pygit2.Repository, head: pygit2.Oid) -> int:
+    """writes ./data/commits the way grpc_script.py does, from the repository itself"""
+    tags = {}
+    for ref in repo.references:
+        if ref.startswith("refs/tags/"):
+            tags[str(repo.references[ref].target)] = ref.removeprefix("refs/tags/")
+
+    written = 0
+    with BatchedWriter("commits", COMMITS_SCHEMA) as writer:
+        for commit in repo.walk(head, pygit2.GIT_SORT_TOPOLOGICAL):
+            writer.writerow(
+                [
+                    str(commit.id),
+                    datetime.utcfromtimestamp(commit.commit_time),
+                    datetime.utcfromtimestamp(commit.author.time),
+                    extract_attributions(commit.message),
+                    tags.get(str(commit.id)),
+                ]
+            )
+            written += 1
+    return written
+
+
+def run_stage(script: str, env: dict, args: list[str] | None = None) -> dict:
+    """
+    Runs a stage through stage_launcher.py: the peak rss wait4 reports starts at the rss
+    of this process at fork, the launcher reports the one of the stage alone.
+    """
+    usage_path = os.path.abspath("./data/benchmark_usage.json")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "stage_launcher.py"),
+            usage_path,
+            os.path.join(SCRIPTS_DIR, script),
+            *(args or []),
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL if DEBUG == "false" else None,
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    stage_usage = {}
+    if os.path.exists(usage_path):
+        with open(usage_path, "rb") as f:
+            stage_usage = orjson.loads(f.read())
+        os.remove(usage_path)
+    return {
+        "returncode": os.waitstatus_to_exitcode(status),
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+        # kilobytes on linux
+        "max_rss_kb": stage_usage.get("max_rss_kb", usage.ru_maxrss),
+    }
+
+
+def previous_result(config: dict) -> dict | None:
+    """latest saved result of a run with the same repository shape"""
+    for path in sorted(glob.glob(os.path.join(BENCH_DIR, "*.json")), reverse=True):
+        with open(path, "rb") as f:
+            result = orjson.loads(f.read())
+        if result.get("config") == config:
+            return result
+    return None
+
+
+def code_revision() -> str | None:
+    revision = subprocess.run(
+        ["git", "-C", SCRIPTS_DIR, "rev-parse", "--short", "HEAD"],
+        capture_output=True,
+        text=True,
+    )
+    return revision.stdout.strip() or None
+
+
+def run():
+    config = {
+        "commits": BENCH_COMMITS,
+        "merge_ratio": BENCH_MERGE_RATIO,
+        "maintainers_ratio": BENCH_MAINTAINERS_RATIO,
+        "contributors": BENCH_CONTRIBUTORS,
+        "seed": BENCH_SEED,
+        "output_format": os.getenv("OUTPUT_FORMAT", "csv"),
+        "enrich_mode": os.getenv("ENRICH_MODE", "diff"),
+    }
+    shape, repo_path = synthetic_repository()
+    work_dir = os.path.join(BENCH_DIR, "work", shape)
+    os.makedirs(os.path.join(work_dir, "data"), exist_ok=True)
+    repo = pygit2.Repository(repo_path)
+
+    # the stages read and write ./data relative to their working directory
+    os.chdir(work_dir)
+    for path in glob.glob("./data/*"):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    env = dict(
+        os.environ,
+        KERNEL_PATH=repo_path,
+        MAINTAINERS_BRANCH="master",
+        # cold runs, nothing reused from a previous benchmark
+        DIFF_CACHE_PATH="",
+    )
+    commits = sum(1 for _ in repo.walk(repo.head.target))
+
+    # the commits dataset is written by a child too, measured like the stages
+    stages = {"commits": run_stage("benchmark.py", env, ["--write-commits", repo_path])}
+    for name, script in STAGES:
+        if any(stage["returncode"] != 0 for stage in stages.values()):
+            break
+        logging.info(f"running {name}")
+        stages[name] = run_stage(script, env)
+    for name, stage in stages.items():
+        if stage["returncode"] != 0:
+            logging.error(f"{name} failed with exit code {stage['returncode']}")
+
+    for stage in stages.values():
+        stage["commits_per_second"] = round(commits / max(stage["wall_seconds"], 1e-9))
+
+    result = {
+        "config": config,
+        "revision": code_revision(),
+        "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commits": commits,
+        "stages": stages,
+    }
+
+    previous = previous_result(config)
+    regressions = []
+    print(f"{'stage':<12} {'wall s':>9} {'commits/s':>10} {'peak MiB':>9}  vs previous")
+    for name, stage in stages.items():
+        line = (
+            f"{name:<12} {stage['wall_seconds']:>9.2f} {stage['commits_per_second']:>10}"
+            f" {stage['max_rss_kb'] / 1024:>9.0f}"
+        )
+        before = previous["stages"].get(name) if previous else None
+        if before:
+            wall_change = stage["wall_seconds"] / max(before["wall_seconds"], 1e-9) - 1
+            rss_change = stage["max_rss_kb"] / max(before["max_rss_kb"], 1) - 1
+            line += f"  wall {wall_change:+.0%}, rss {rss_change:+.0%}"
+            if wall_change > BENCH_TOLERANCE or rss_change > BENCH_TOLERANCE:
+                regressions.append(name)
+        print(line)
+
+    path = os.path.join(
+        BENCH_DIR, f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    logging.info(f"results saved to {path}")
+
+    if regressions:
+        logging.warning(
+            f"regressions over {BENCH_TOLERANCE:.0%} against {previous['revision']}: "
+            + ", ".join(regressions)
+        )
+    if any(stage["returncode"] != 0 for stage in stages.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if "--write-commits" in sys.argv:
+        # run by run_stage from the work directory
+        repo = pygit2.Repository(sys.argv[sys.argv.index("--write-commits") + 1])
+        write_commits_dataset(repo, repo.head.target)
+    else:
+        run()
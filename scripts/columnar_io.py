@@ -0,0 +1,336 @@
+import csv
+import os
+from datetime import datetime
+
+import orjson
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import instrumentation
+
+# "csv" keeps the pipe separated files, "parquet" writes typed columnar files
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")
+WRITER_BATCH_SIZE = int(os.getenv("WRITER_BATCH_SIZE", "8192"))
+DATA_DIR = "./data"
+
+# layout of the parquet datasets served to the web app: bounded row groups with min/max
+# statistics, so scans filtering on dates skip most of them, and dictionary encoded
+# strings, the same emails repeat on every row
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", "65536"))
+PARQUET_COMPRESSION_LEVEL = int(os.getenv("PARQUET_COMPRESSION_LEVEL", "9"))
+
+# dates are microsecond timestamps, the unit of polars datetimes: parquet has no second
+# unit, and polars filtering on the second timestamps arrow writes skips every row group
+ATTRIBUTIONS_TYPE = pa.list_(
+    pa.struct(
+        [
+            pa.field("type", pa.string()),
+            pa.field("name", pa.string()),
+            pa.field("email", pa.string()),
+        ]
+    )
+)
+
+# output of grpc_script.py
+COMMITS_SCHEMA = pa.schema(
+    [
+        pa.field("commit", pa.string()),
+        pa.field("committer_date", pa.timestamp("us")),
+        pa.field("author_date", pa.timestamp("us")),
+        pa.field("attributions", ATTRIBUTIONS_TYPE),
+        pa.field("tag", pa.string()),
+    ]
+)
+
+# trees crawled by grpc_script.py, tree_id is the bit of the tree in commit_trees
+TREES_SCHEMA = pa.schema(
+    [
+        pa.field("tree_id", pa.int64()),
+        pa.field("name", pa.string()),
+        pa.field("origin", pa.string()),
+        pa.field("branch", pa.string()),
+        pa.field("head", pa.string()),
+    ]
+)
+
+# trees each crawled commit belongs to, as a bitmap of tree ids
+COMMIT_TREES_SCHEMA = pa.schema(
+    [
+        pa.field("commit", pa.string()),
+        pa.field("trees", pa.int64()),
+    ]
+)
+
+# output of enrich_from_git.py
+ENHANCED_SCHEMA = pa.schema(
+    [
+        pa.field("commit", pa.string()),
+        pa.field("committer_date", pa.timestamp("us")),
+        pa.field("author_date", pa.timestamp("us")),
+        pa.field("insertions", pa.int64()),
+        pa.field("deletions", pa.int64()),
+        pa.field("author", pa.string()),
+        pa.field("committer", pa.string()),
+        pa.field("attributions", ATTRIBUTIONS_TYPE),
+        pa.field("tag", pa.string()),
+    ]
+)
+
+TAGS_SCHEMA = pa.schema(
+    [
+        pa.field("tag", pa.string()),
+        pa.field("commit", pa.string()),
+        pa.field("date", pa.timestamp("us")),
+    ]
+)
+
+# dictionary of the paths touched by commits, written by enrich_from_git.py
+PATHS_SCHEMA = pa.schema(
+    [
+        pa.field("path_id", pa.uint32()),
+        pa.field("path", pa.string()),
+    ]
+)
+
+# ids of the paths touched by each commit, in the same order as enhanced
+COMMIT_PATHS_SCHEMA = pa.schema(
+    [
+        pa.field("commit", pa.string()),
+        pa.field("path_ids", pa.list_(pa.uint32())),
+    ]
+)
+
+MAINTAINERS_ENTRIES_TYPE = pa.list_(
+    pa.struct(
+        [
+            pa.field("section", pa.string()),
+            pa.field("email", pa.string()),
+        ]
+    )
+)
+
+# outputs of get_official_kernel_maintainers.py, one row per MAINTAINERS version, oldest first
+MAINTAINERS_HISTORY_SCHEMA = pa.schema(
+    [
+        pa.field("version", pa.uint32()),
+        pa.field("commit", pa.string()),
+        pa.field("committer_date", pa.timestamp("us")),
+        pa.field("added", MAINTAINERS_ENTRIES_TYPE),
+        pa.field("removed", MAINTAINERS_ENTRIES_TYPE),
+    ]
+)
+
+# full list of entries of every SNAPSHOT_EVERY-th version
+MAINTAINERS_SNAPSHOTS_SCHEMA = pa.schema(
+    [
+        pa.field("version", pa.uint32()),
+        pa.field("commit", pa.string()),
+        pa.field("committer_date", pa.timestamp("us")),
+        pa.field("maintainers", MAINTAINERS_ENTRIES_TYPE),
+    ]
+)
+
+
+def data_path(name: str, output_format: str = OUTPUT_FORMAT) -> str:
+    return os.path.join(DATA_DIR, f"{name}.{output_format}")
+
+
+def _is_nested(data_type: pa.DataType) -> bool:
+    return pa.types.is_list(data_type) or pa.types.is_struct(data_type)
+
+
+class BatchedWriter:
+    """
+    Collects rows in memory and writes them in batches, either as arrow record batches
+    into a parquet file, or as pipe separated csv rows.
+    Rows hold native values: lists/structs are json encoded and datetimes formatted with
+    `datetime_format` only when writing csv.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        schema: pa.Schema,
+        output_format: str = OUTPUT_FORMAT,
+        batch_size: int = WRITER_BATCH_SIZE,
+        datetime_format: str = "%Y-%m-%dT%H:%M:%S",
+    ):
+        self.name = name
+        self.path = data_path(name, output_format)
+        self.schema = schema
+        self.output_format = output_format
+        self.batch_size = batch_size
+        self.datetime_format = datetime_format
+        self._rows = []
+
+        if output_format == "parquet":
+            self._writer = pq.ParquetWriter(self.path, schema, compression="zstd")
+        elif output_format == "csv":
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(
+                self._file, delimiter="|", quoting=csv.QUOTE_ALL, lineterminator="\n"
+            )
+            self._writer.writerow(schema.names)
+        else:
+            raise ValueError(f"Unknown output format: {output_format}")
+
+    def writerow(self, row: list):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows: list[list]):
+        for row in rows:
+            self.writerow(row)
+
+    def _csv_value(self, value, data_type: pa.DataType):
+        if value is None:
+            return None
+        if _is_nested(data_type):
+            return orjson.dumps(value).decode()
+        if isinstance(value, datetime):
+            return value.strftime(self.datetime_format)
+        return value
+
+    def flush(self):
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        instrumentation.count(f"{self.name}_rows", len(rows))
+
+        if self.output_format == "parquet":
+            columns = zip(*rows)
+            self._writer.write_batch(
+                pa.RecordBatch.from_arrays(
+                    [
+                        pa.array(column, type=field.type)
+                        for column, field in zip(columns, self.schema)
+                    ],
+                    schema=self.schema,
+                )
+            )
+        else:
+            types = self.schema.types
+            self._writer.writerows(
+                [[self._csv_value(v, t) for v, t in zip(row, types)] for row in rows]
+            )
+
+    def close(self):
+        self.flush()
+        if self.output_format == "parquet":
+            self._writer.close()
+        else:
+            self._file.close()
+        instrumentation.count(f"{self.name}_bytes", os.path.getsize(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def tuned_parquet_writer(path: str, schema: pa.Schema) -> pq.ParquetWriter:
+    return pq.ParquetWriter(
+        path,
+        schema,
+        compression="zstd",
+        compression_level=PARQUET_COMPRESSION_LEVEL,
+        use_dictionary=True,
+        write_statistics=True,
+    )
+
+
+def write_tuned_parquet(
+    df: pl.DataFrame, path: str, sort_by: str | list[str] = "committer_date"
+):
+    """Writes df sorted by `sort_by` with the tuned parquet layout."""
+    table = df.sort(sort_by, maintain_order=True).to_arrow()
+    with tuned_parquet_writer(path, table.schema) as writer:
+        writer.write_table(table, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    instrumentation.count("parquet_bytes", os.path.getsize(path))
+
+
+def sink_tuned_parquet(lf: pl.LazyFrame, path: str):
+    """
+    Writes an already sorted lazy frame with the tuned parquet layout, without collecting it.
+    The polars sink does not dictionary encode nested strings, so its output is staged
+    and rewritten a row group at a time.
+    """
+    staging_path = f"{path}.staging"
+    try:
+        lf.sink_parquet(
+            staging_path, row_group_size=PARQUET_ROW_GROUP_SIZE, engine="streaming"
+        )
+        staged = pq.ParquetFile(staging_path)
+        with tuned_parquet_writer(path, staged.schema_arrow) as writer:
+            for i in range(staged.num_row_groups):
+                writer.write_table(
+                    staged.read_row_group(i), row_group_size=PARQUET_ROW_GROUP_SIZE
+                )
+        instrumentation.count("parquet_bytes", os.path.getsize(path))
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+
+def _from_csv(value: str, data_type: pa.DataType):
+    if value == "":
+        return None
+    if _is_nested(data_type):
+        return orjson.loads(value)
+    if pa.types.is_timestamp(data_type):
+        return datetime.fromisoformat(value)
+    if pa.types.is_integer(data_type):
+        return int(value)
+    return value
+
+
+def read_rows(name: str, schema: pa.Schema, output_format: str = OUTPUT_FORMAT):
+    """
+    Iterates over the rows of a dataset written by BatchedWriter, as dicts of native values.
+    """
+    path = data_path(name, output_format)
+    if output_format == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=WRITER_BATCH_SIZE):
+            yield from batch.to_pylist()
+        return
+
+    types = {field.name: field.type for field in schema}
+    with open(path, "r", newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file, delimiter="|"):
+            yield {
+                key: _from_csv(value, types[key]) if key in types else value
+                for key, value in row.items()
+            }
+
+
+def scan_frame(
+    name: str, schema: pa.Schema, output_format: str = OUTPUT_FORMAT
+) -> pl.LazyFrame:
+    """
+    Lazily scans a dataset written by BatchedWriter, typed with `schema`.
+    Parquet files are already typed, csv files have their json columns decoded.
+    """
+    path = data_path(name, output_format)
+    if output_format == "parquet":
+        return pl.scan_parquet(path)
+
+    dtypes = pl.from_arrow(schema.empty_table()).schema
+    df = pl.scan_csv(path, separator="|", try_parse_dates=True)
+    columns = df.collect_schema().names()
+    return df.with_columns(
+        [
+            pl.col(field.name).str.json_decode(dtype=dtypes[field.name])
+            for field in schema
+            if _is_nested(field.type) and field.name in columns
+        ]
+    )
+
+
+def read_frame(
+    name: str, schema: pa.Schema, output_format: str = OUTPUT_FORMAT
+) -> pl.DataFrame:
+    """Reads a dataset written by BatchedWriter into a polars DataFrame typed with `schema`."""
+    return scan_frame(name, schema, output_format).collect()
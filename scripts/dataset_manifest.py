@@ -0,0 +1,60 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+
+import orjson
+import pyarrow.parquet as pq
+
+# version and summary of the datasets served to the web app, bumped on every write
+MANIFEST_PATH = "./data/manifest.json"
+
+
+def replace_atomically(path: str, write):
+    """
+    Calls write(tmp_path), then moves the written file over `path`, so readers
+    only ever see the previous or the new file.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def describe_parquet(path: str) -> dict:
+    """manifest entry of a parquet file, the hash lets readers compare contents cheaply"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    metadata = pq.ParquetFile(path).metadata
+    return {
+        "path": os.path.relpath(path, os.path.dirname(MANIFEST_PATH)),
+        "rows": metadata.num_rows,
+        "row_groups": metadata.num_row_groups,
+        "bytes": os.path.getsize(path),
+        "sha256": digest.hexdigest(),
+    }
+
+
+def read_manifest(path: str = MANIFEST_PATH) -> dict:
+    if not os.path.exists(path):
+        return {"version": 0}
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def bump_manifest(path: str = MANIFEST_PATH, **fields) -> dict:
+    # only the version carries over, the other fields describe the current datasets
+    manifest = dict(fields)
+    manifest["version"] = read_manifest(path).get("version", 0) + 1
+    manifest["updated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+    replace_atomically(path, write)
+    return manifest
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+
+import orjson
+
+# persistent diff stats per commit sha, set to an empty string to disable the cache
+DIFF_CACHE_PATH = os.getenv("DIFF_CACHE_PATH", "./data/diffstats.sqlite")
+
+# sqlite limits the number of variables in a single statement
+_QUERY_CHUNK = 500
+
+
+class DiffStatCache:
+    """
+    Append-only store of commit sha -> (insertions, deletions, author email, committer email,
+    touched paths). A commit never changes, so entries are never updated once written,
+    except to fill in the paths of commits cached before paths were captured.
+    """
+
+    def __init__(self, path: str = DIFF_CACHE_PATH):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS diffstats (
+                commit_sha TEXT PRIMARY KEY,
+                insertions INTEGER NOT NULL,
+                deletions INTEGER NOT NULL,
+                author TEXT,
+                committer TEXT,
+                paths TEXT
+            ) WITHOUT ROWID
+            """)
+        # heads of the last `git log --numstat` ingested, their history is cached
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS numstat_heads (commit_sha TEXT PRIMARY KEY)"
+        )
+        # caches created before paths were captured
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(diffstats)")]
+        if "paths" not in columns:
+            self._db.execute("ALTER TABLE diffstats ADD COLUMN paths TEXT")
+        self._db.commit()
+
+    # entries without paths are skipped when require_paths is set
+    def get_many(
+        self, shas: list[str], require_paths: bool = False
+    ) -> dict[str, tuple]:
+        found = {}
+        condition = " AND paths IS NOT NULL" if require_paths else ""
+        for i in range(0, len(shas), _QUERY_CHUNK):
+            chunk = shas[i : i + _QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for (
+                sha,
+                insertions,
+                deletions,
+                author,
+                committer,
+                paths,
+            ) in self._db.execute(
+                "SELECT commit_sha, insertions, deletions, author, committer, paths "
+                f"FROM diffstats WHERE commit_sha IN ({placeholders}){condition}",
+                chunk,
+            ):
+                found[sha] = (
+                    insertions,
+                    deletions,
+                    author,
+                    committer,
+                    orjson.loads(paths) if paths is not None else None,
+                )
+        return found
+
+    # rows of (sha, insertions, deletions, author email, committer email, paths or None)
+    def put_many(self, rows: list[tuple]):
+        if rows:
+            self._db.executemany(
+                """
+                INSERT INTO diffstats VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (commit_sha) DO UPDATE SET paths = excluded.paths
+                WHERE diffstats.paths IS NULL
+                """,
+                [
+                    (*row[:5], orjson.dumps(row[5]) if row[5] is not None else None)
+                    for row in rows
+                ],
+            )
+            self._db.commit()
+
+    def numstat_heads(self) -> list[str]:
+        return [
+            row[0] for row in self._db.execute("SELECT commit_sha FROM numstat_heads")
+        ]
+
+    # replaces the heads once the whole history behind them is cached
+    def set_numstat_heads(self, shas: list[str]):
+        self._db.execute("DELETE FROM numstat_heads")
+        self._db.executemany(
+            "INSERT OR IGNORE INTO numstat_heads VALUES (?)", [(sha,) for sha in shas]
+        )
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute("SELECT count(*) FROM diffstats").fetchone()[0]
+
+    def close(self):
+        self._db.close()
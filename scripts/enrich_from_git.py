@@ -1,16 +1,45 @@
 import logging
 import subprocess
-import csv
-import orjson
 import os
 import re
+import tempfile
+import time
 from datetime import timedelta, datetime
 
 from pygit2 import Repository
 
+from batch_pool import OrderedBatchPool
+from columnar_io import (
+    BatchedWriter,
+    read_rows,
+    COMMITS_SCHEMA,
+    ENHANCED_SCHEMA,
+    TAGS_SCHEMA,
+)
+from diffstat_cache import DiffStatCache, DIFF_CACHE_PATH
+import instrumentation
+from path_index import PathIndexWriter
+
 kernel_path = os.getenv("KERNEL_PATH", ".")
+# clones of the other trees crawled with KERNEL_TREES, separated by os.pathsep.
+# Commits missing from KERNEL_PATH are diffed in the first of them that has them
+EXTRA_KERNEL_PATHS = [
+    path for path in os.getenv("EXTRA_KERNEL_PATHS", "").split(os.pathsep) if path
+]
 
 LOAD_TAGS_FROM_REPO = os.getenv("LOAD_TAGS_FROM_REPO", "false") != "false"
+# "diff" diffs each commit with pygit2, "numstat" reads the stats of the whole history
+# from a single `git log --numstat` stream first
+ENRICH_MODE = os.getenv("ENRICH_MODE", "diff")
+# revisions walked by the numstat mode
+NUMSTAT_REVS = os.getenv("NUMSTAT_REVS", "HEAD").split()
+# diff stats are computed by this many processes, 0 computes them in the main process
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", os.cpu_count()))
+ENRICH_BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", "256"))
+# records the paths touched by each commit into commit_paths/paths
+CAPTURE_PATHS = os.getenv("CAPTURE_PATHS", "true") != "false"
+# logs the throughput every PROGRESS_EVERY commits
+PROGRESS_EVERY = int(os.getenv("PROGRESS_EVERY", "10000"))
 DEBUG = os.getenv("DEBUG", "false")
 level = logging.INFO
 if DEBUG != "false":
@@ -23,19 +52,18 @@ logging.basicConfig(
 )
 
 
-def fix_attributions(attributions, author, committer):
-    attrs = orjson.loads(attributions)
+def fix_attributions(attributions, author_email: str, committer_email: str):
     new_attrs_block = []
 
-    for attr in attrs:
+    for attr in attributions or []:
         # remove author and committer duplicate
         if (
             attr.get("email")
-            and attr["email"] != author.email
-            and attr["email"] != committer.email
+            and attr["email"] != author_email
+            and attr["email"] != committer_email
         ):
             new_attrs_block.append(attr)
-    return orjson.dumps(new_attrs_block).decode()
+    return new_attrs_block
 
 
 def read_tags(repo: Repository) -> list[[str]]:
@@ -89,15 +117,168 @@ def read_tags(repo: Repository) -> list[[str]]:
 
 
 def write_tags_file(tags: list[[str]]):
-    tags_file = open("./data/tags.csv", "w", newline="", buffering=1, encoding="utf-8")
-    tags_writer = csv.writer(
-        tags_file, delimiter="|", quoting=csv.QUOTE_ALL, lineterminator="\n"
+    # dates keep the "yyyy-mm-dd hh:mm:ss" format expected by the dashboard
+    with BatchedWriter(
+        "tags", TAGS_SCHEMA, datetime_format="%Y-%m-%d %H:%M:%S"
+    ) as tags_writer:
+        tags_writer.writerows(tags)
+
+
+# repositories of the current process, each worker opens its own
+_repos = []
+
+
+def open_repository(kernel_paths: list[str]):
+    global _repos
+    _repos = [Repository(path) for path in kernel_paths]
+
+
+# returns (insertions, deletions, author email, committer email, touched paths),
+# or None if the commit is unknown. Paths are None when CAPTURE_PATHS is disabled
+def commit_stats(sha: str) -> tuple | None:
+    for repo in _repos:
+        commit = repo.get(sha)
+        if commit is not None:
+            break
+    else:
+        return None
+    parents = commit.parents
+
+    # merge commits default to 0 (should be accounted by the commits themselves)
+    insertions = 0
+    deletions = 0
+    paths = []
+
+    # more than one parent indicates a merge commit
+    if len(parents) == 1:
+        parent = parents[0]
+        if parent is not None:
+            # note: the diff goes from the commit to its parent, read_numstat follows the same convention
+            diff = repo.diff(commit.id, parent.id)
+            insertions = diff.stats.insertions
+            deletions = diff.stats.deletions
+            if CAPTURE_PATHS:
+                paths = [delta.new_file.path for delta in diff.deltas]
+
+    return (
+        insertions,
+        deletions,
+        commit.author.email,
+        commit.committer.email,
+        paths if CAPTURE_PATHS else None,
     )
 
-    tags_writer.writerow(["tag", "commit", "date"])
 
-    for tag_line in tags:
-        tags_writer.writerow(tag_line)
+# cached commits are sent as None and skipped
+def commit_stats_batch(shas: list[str | None]) -> list[tuple | None]:
+    return [commit_stats(sha) if sha is not None else None for sha in shas]
+
+
+# groups rows in lists of `size` elements
+def batched(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_numstat(kernel_path: str, revs: list[str], chunk_size: int = 1 << 20):
+    """
+    Streams `git log --numstat` over revs, yielding one
+    (sha, insertions, deletions, author email, committer email, touched paths) row per commit,
+    following the same rules as commit_stats. Memory is bounded by a single commit.
+    """
+    process = subprocess.Popen(
+        [
+            "git",
+            "log",
+            "-z",
+            "--numstat",
+            "--no-renames",
+            "--no-mailmap",
+            "--no-color",
+            # \x01 marks the start of a commit: "sha parents", author email, committer email
+            "--format=%x01%H %P%x00%ae%x00%ce",
+            *revs,
+            "--",
+        ],
+        cwd=kernel_path,
+        stdout=subprocess.PIPE,
+    )
+
+    current = None
+    single_parent = False
+    fields = []
+    rest = b""
+    while True:
+        chunk = process.stdout.read(chunk_size)
+        tokens = (rest + chunk).split(b"\0")
+        # the last token may be incomplete, keep it for the next chunk
+        rest = tokens.pop() if chunk else b""
+        for token in tokens:
+            if token.startswith(b"\x01"):
+                if current is not None:
+                    yield current
+                fields = [token[1:].decode()]
+                current = None
+            elif len(fields) < 3:
+                fields.append(token.decode("utf-8", errors="replace"))
+                if len(fields) == 3:
+                    sha, *parents = fields[0].split()
+                    current = [sha, 0, 0, fields[1], fields[2], []]
+                    single_parent = len(parents) == 1
+            elif current is not None and single_parent and token.strip(b"\n"):
+                added, removed, path = token.lstrip(b"\n").split(b"\t", 2)
+                # binary files are reported as "-", and count as 0 lines like in pygit2.
+                # insertions/deletions are swapped to match the commit -> parent diff of commit_stats
+                if removed != b"-":
+                    current[1] += int(removed)
+                if added != b"-":
+                    current[2] += int(added)
+                current[5].append(path.decode("utf-8", errors="replace"))
+        if not chunk:
+            break
+    if current is not None:
+        yield current
+
+    if process.wait() != 0:
+        raise RuntimeError(f"git log failed with exit code {process.returncode}")
+
+
+# fills the cache with the stats of every commit in revs, non merge commits only are diffed.
+# The history behind the heads ingested by a previous run is already cached and skipped
+def ingest_numstat(
+    cache: DiffStatCache, repo: Repository, kernel_path: str, revs: list[str]
+):
+    heads = subprocess.run(
+        ["git", "rev-parse", *revs, "--"],
+        cwd=kernel_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    heads = [head for head in heads if not head.startswith("^") and head != "--"]
+    # heads of another repository, or rewritten since, can't be excluded
+    known = [f"^{sha}" for sha in cache.numstat_heads() if repo.get(sha) is not None]
+
+    logging.info(
+        f"Reading numstat of {' '.join(revs)} from {kernel_path}, "
+        f"{len(known)} previously read heads excluded"
+    )
+    start = time.perf_counter()
+    ingested = 0
+    for rows in batched(read_numstat(kernel_path, [*heads, *known]), 10000):
+        cache.put_many([tuple(row) for row in rows])
+        ingested += len(rows)
+        logging.info(
+            f"{ingested} commits read from git log, "
+            f"{ingested / (time.perf_counter() - start):.0f} commits/s"
+        )
+    cache.set_numstat_heads(heads)
 
 
 def run(kernel_path: str):
@@ -107,73 +288,132 @@ def run(kernel_path: str):
     repo = Repository(kernel_path)
     repo.get(INITIAL_COMMIT)
 
-    commits_file = open("./data/commits.csv", "r")
-    reader = csv.DictReader(commits_file, delimiter="|")
+    reader = read_rows("commits", COMMITS_SCHEMA)
 
-    file = open("./data/enhanced.csv", "w", newline="", buffering=1, encoding="utf-8")
-    writer = csv.writer(file, delimiter="|", quoting=csv.QUOTE_ALL, lineterminator="\n")
-    writer.writerow(
-        [
-            "commit",
-            "committer_date",
-            "author_date",
-            "insertions",
-            "deletions",
-            "author",
-            "committer",
-            "attributions",
-            "tag",
-        ]
-    )
+    writer = BatchedWriter("enhanced", ENHANCED_SCHEMA)
 
     if LOAD_TAGS_FROM_REPO:
         # read all tags from repo
-        tags = read_tags(repo)
+        with instrumentation.phase("read_tags"):
+            tags = read_tags(repo)
         # write a tag:commit csv file
         write_tags_file(tags)
 
         # map commit:tag for reverse lookup
         tag_map = {tagl[1]: tagl[0] for tagl in tags}
 
-    for row in reader:
-        commit = repo.get(row["commit"])
-        if commit is not None:
-            parents = commit.parents
-
-            # merge commits default to 0 (should be accounted by the commits themselves)
-            insertions = 0
-            deletions = 0
-
-            # more than one parent indicates a merge commit
-            if len(parents) == 1:
-                parent = parents[0]
-                if parent is not None:
-                    diff = repo.diff(commit.id, parent.id)
-                    insertions = diff.stats.insertions
-                    deletions = diff.stats.deletions
-
-            writer.writerow(
-                [
-                    row["commit"],
-                    # row["parents"],
-                    row["committer_date"],
-                    row["author_date"],
-                    insertions,
-                    deletions,
-                    commit.author.email,
-                    commit.committer.email,
-                    fix_attributions(
-                        row["attributions"], commit.author, commit.committer
-                    ),
-                    # load tag from original file or from Repository
-                    tag_map.get(row["commit"])
-                    if LOAD_TAGS_FROM_REPO
-                    else row.get("tag"),
-                ]
-            )
-
-    file.close()
+    # stats of commits enriched by previous runs are reused, only new commits are diffed
+    cache = None
+    cache_path = DIFF_CACHE_PATH
+    temporary_cache = not cache_path and ENRICH_MODE == "numstat"
+    if temporary_cache:
+        # the numstat stream is joined to the commits through the cache, removed at the end
+        fd, cache_path = tempfile.mkstemp(suffix=".sqlite", dir="./data")
+        os.close(fd)
+    if cache_path:
+        cache = DiffStatCache(cache_path)
+
+    try:
+        if ENRICH_MODE == "numstat":
+            with instrumentation.phase("numstat"):
+                ingest_numstat(cache, repo, kernel_path, NUMSTAT_REVS)
+        # touched paths, for path prefix filters in later stages
+        path_index = PathIndexWriter() if CAPTURE_PATHS else None
+        start = time.perf_counter()
+        processed = 0
+        cache_hits = 0
+
+        def write_batch(items: list[tuple], stats: list[tuple | None]):
+            nonlocal processed
+            new_stats = []
+            for (row, cached), commit_stat in zip(items, stats):
+                if cached is not None:
+                    commit_stat = cached
+                elif commit_stat is None:
+                    continue
+                else:
+                    new_stats.append((row["commit"], *commit_stat))
+                insertions, deletions, author_email, committer_email, paths = (
+                    commit_stat
+                )
+                if path_index is not None:
+                    path_index.add(row["commit"], paths)
+                writer.writerow(
+                    [
+                        row["commit"],
+                        # row["parents"],
+                        row["committer_date"],
+                        row["author_date"],
+                        insertions,
+                        deletions,
+                        author_email,
+                        committer_email,
+                        fix_attributions(
+                            row["attributions"], author_email, committer_email
+                        ),
+                        # load tag from original file or from Repository
+                        (
+                            tag_map.get(row["commit"])
+                            if LOAD_TAGS_FROM_REPO
+                            else row.get("tag")
+                        ),
+                    ]
+                )
+
+            instrumentation.count("commits_diffed", len(new_stats))
+            if cache is not None:
+                cache.put_many(new_stats)
+
+            previous = processed
+            processed += len(items)
+            if processed // PROGRESS_EVERY > previous // PROGRESS_EVERY:
+                elapsed = time.perf_counter() - start
+                logging.info(
+                    f"{processed} commits enriched, {processed / elapsed:.0f} commits/s"
+                )
+
+        # diffs are computed by ENRICH_WORKERS processes, rows are written back in input order
+        with (
+            instrumentation.phase("enrich"),
+            OrderedBatchPool(
+                commit_stats_batch,
+                write_batch,
+                workers=ENRICH_WORKERS,
+                batch_size=ENRICH_BATCH_SIZE,
+                initializer=open_repository,
+                initargs=([kernel_path, *EXTRA_KERNEL_PATHS],),
+                payload=lambda item: item[0]["commit"] if item[1] is None else None,
+            ) as pool,
+        ):
+            for rows in batched(reader, ENRICH_BATCH_SIZE):
+                cached = (
+                    cache.get_many([row["commit"] for row in rows], CAPTURE_PATHS)
+                    if cache
+                    else {}
+                )
+                cache_hits += len(cached)
+                instrumentation.count("cache_hits", len(cached))
+                for row in rows:
+                    pool.submit((row, cached.get(row["commit"])))
+
+        writer.close()
+        if path_index is not None:
+            path_index.close()
+        elapsed = time.perf_counter() - start
+        logging.info(
+            f"{processed} commits enriched in {elapsed:.1f}s "
+            f"({processed / max(elapsed, 1e-9):.0f} commits/s, {pool.workers} workers, "
+            f"{cache_hits} from cache)"
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+        if temporary_cache:
+            for path in [cache_path, f"{cache_path}-wal", f"{cache_path}-shm"]:
+                if os.path.exists(path):
+                    os.remove(path)
 
 
 if __name__ == "__main__":
+    instrumentation.start("enrich")
     run(kernel_path)
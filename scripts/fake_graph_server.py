@@ -0,0 +1,369 @@
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+import pygit2
+import swh.graph.grpc.swhgraph_pb2 as swhgraph
+import swh.graph.grpc.swhgraph_pb2_grpc as swhgraph_grpc
+
+DEBUG = os.getenv("DEBUG", "false")
+level = logging.INFO
+if DEBUG != "false":
+    level = logging.DEBUG
+
+logging.basicConfig(
+    level=level,
+    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+FAKE_GRAPH_BIND = os.getenv("FAKE_GRAPH_BIND", "0.0.0.0:50091")
+FAKE_GRAPH_WORKERS = int(os.getenv("FAKE_GRAPH_WORKERS", "16"))
+# repository the graph is sampled from, the synthetic benchmark repository
+# (shaped by the BENCH_* settings) is generated and used when empty
+FAKE_GRAPH_REPO = os.getenv("FAKE_GRAPH_REPO", "")
+# revisions sampled from the heads of the branches, 0 for all of them
+FAKE_GRAPH_LIMIT = int(os.getenv("FAKE_GRAPH_LIMIT", "0"))
+# delay added to every request, uniformly drawn between latency and latency + jitter
+FAKE_GRAPH_LATENCY_MS = float(os.getenv("FAKE_GRAPH_LATENCY_MS", "0"))
+FAKE_GRAPH_JITTER_MS = float(os.getenv("FAKE_GRAPH_JITTER_MS", "0"))
+# share of the requests failed with UNAVAILABLE, like an overloaded server
+FAKE_GRAPH_ERROR_RATE = float(os.getenv("FAKE_GRAPH_ERROR_RATE", "0"))
+FAKE_GRAPH_SEED = int(os.getenv("FAKE_GRAPH_SEED", "1"))
+# seconds between two throughput reports
+FAKE_GRAPH_REPORT_EVERY = float(os.getenv("FAKE_GRAPH_REPORT_EVERY", "10"))
+KERNEL_TREE = os.getenv(
+    "KERNEL_TREE", "git://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linux.git"
+)
+DEFAULT_BRANCH = os.getenv("DEFAULT_BRANCH", "master")
+
+
+def swhid(node_type: str, key: bytes | str) -> str:
+    if isinstance(key, bytes):
+        key = hashlib.sha1(key).hexdigest()
+    return f"swh:1:{node_type}:{key}"
+
+
+class SampledGraph:
+    """
+    The part of the swh graph the crawler walks, built from a git repository:
+    origin -> snapshot -> branches and releases -> revisions -> parents and root directory.
+    Git revision and directory ids are the swh ones, releases of lightweight tags and
+    the snapshot get ids hashed from their names.
+    Revisions outside the sample are left out of their children's successors.
+    """
+
+    def __init__(self, repo: pygit2.Repository, limit: int = 0):
+        self.nodes = {}
+        self.people = {}
+
+        # the default branch first, so a limited sample keeps its latest commits
+        walker = repo.walk(
+            repo.references[f"refs/heads/{DEFAULT_BRANCH}"].target,
+            pygit2.GIT_SORT_TOPOLOGICAL,
+        )
+        for name in repo.references:
+            if name.startswith("refs/heads/"):
+                walker.push(repo.references[name].resolve().target)
+        sampled = []
+        for commit in walker:
+            sampled.append(commit)
+            if limit and len(sampled) >= limit:
+                break
+        revisions = {str(commit.id) for commit in sampled}
+        for commit in sampled:
+            self.add_revision(commit, revisions)
+
+        snapshot = swhgraph.Node()
+        for name in sorted(repo.references):
+            reference = repo.references[name].resolve()
+            target = repo[reference.target]
+            if name.startswith("refs/heads/"):
+                commit = target.peel(pygit2.Commit)
+                if str(commit.id) in revisions:
+                    successor = snapshot.successor.add(
+                        swhid=swhid("rev", str(commit.id))
+                    )
+                    successor.label.add(name=name.encode())
+            elif name.startswith("refs/tags/"):
+                commit = target.peel(pygit2.Commit)
+                if str(commit.id) not in revisions:
+                    continue
+                release = self.add_release(name, target, commit)
+                successor = snapshot.successor.add(swhid=release)
+                successor.label.add(name=name.encode())
+        snapshot.swhid = swhid(
+            "snp", b"".join(s.swhid.encode() for s in snapshot.successor)
+        )
+        snapshot.num_successors = len(snapshot.successor)
+        self.nodes[snapshot.swhid] = snapshot
+
+        origin = swhgraph.Node(
+            swhid=swhid("ori", KERNEL_TREE.encode()), num_successors=1
+        )
+        origin.ori.url = KERNEL_TREE
+        successor = origin.successor.add(swhid=snapshot.swhid)
+        successor.label.add(visit_timestamp=int(time.time()), is_full_visit=True)
+        self.nodes[origin.swhid] = origin
+
+        self.revisions = len(revisions)
+        self.origin = origin.swhid
+        self._predecessors = None
+        self._lock = threading.Lock()
+
+    def person(self, signature: pygit2.Signature) -> int:
+        # the graph only exposes pseudonymized person ids
+        return self.people.setdefault(signature.email, len(self.people))
+
+    def add_revision(self, commit: pygit2.Commit, revisions: set[str]):
+        node = swhgraph.Node(swhid=swhid("rev", str(commit.id)))
+        for parent in commit.parent_ids:
+            if str(parent) in revisions:
+                node.successor.add(swhid=swhid("rev", str(parent)))
+        directory = swhid("dir", str(commit.tree_id))
+        node.successor.add(swhid=directory)
+        node.num_successors = len(node.successor)
+        node.rev.author = self.person(commit.author)
+        node.rev.author_date = commit.author.time
+        node.rev.author_date_offset = commit.author.offset
+        node.rev.committer = self.person(commit.committer)
+        node.rev.committer_date = commit.commit_time
+        node.rev.committer_date_offset = commit.commit_time_offset
+        node.rev.message = commit.raw_message
+        self.nodes[node.swhid] = node
+        # directories are only walked into by traversals, they have no data
+        self.nodes.setdefault(directory, swhgraph.Node(swhid=directory))
+
+    def add_release(self, name: str, target, commit: pygit2.Commit) -> str:
+        if isinstance(target, pygit2.Tag):
+            node = swhgraph.Node(swhid=swhid("rel", str(target.id)))
+            node.rel.message = target.raw_message
+            if target.tagger is not None:
+                node.rel.author = self.person(target.tagger)
+                node.rel.author_date = target.tagger.time
+                node.rel.author_date_offset = target.tagger.offset
+        else:
+            node = swhgraph.Node(swhid=swhid("rel", name.encode()))
+        node.rel.name = name.removeprefix("refs/tags/").encode()
+        node.successor.add(swhid=swhid("rev", str(commit.id)))
+        node.num_successors = 1
+        self.nodes[node.swhid] = node
+        return node.swhid
+
+    def predecessors(self) -> dict[str, list[str]]:
+        """reversed edges, built on the first backward traversal"""
+        with self._lock:
+            if self._predecessors is None:
+                predecessors = {}
+                for node in self.nodes.values():
+                    for successor in node.successor:
+                        predecessors.setdefault(successor.swhid, []).append(node.swhid)
+                self._predecessors = predecessors
+        return self._predecessors
+
+
+def masked(node: swhgraph.Node, mask) -> swhgraph.Node:
+    """
+    Copy of node with only the fields of a FieldMask.
+    FieldMask.MergeMessage does not take sub-fields of repeated fields, the crawler
+    asks for "successor.swhid".
+    """
+    if mask is None or not mask.paths:
+        return node
+    out = swhgraph.Node()
+    successor_fields = set()
+    for path in mask.paths:
+        name, _, sub = path.partition(".")
+        if name == "successor":
+            successor_fields.add(sub)
+        elif name == "swhid":
+            out.swhid = node.swhid
+        elif name == "num_successors":
+            out.num_successors = node.num_successors
+        elif not node.HasField(name):
+            continue
+        elif sub:
+            setattr(getattr(out, name), sub, getattr(getattr(node, name), sub))
+        else:
+            getattr(out, name).CopyFrom(getattr(node, name))
+    if successor_fields:
+        for successor in node.successor:
+            copy = out.successor.add()
+            if "" in successor_fields or "swhid" in successor_fields:
+                copy.swhid = successor.swhid
+            if "" in successor_fields or "label" in successor_fields:
+                copy.label.extend(successor.label)
+    return out
+
+
+def edge_allowed(edges: str, source: str, target: str) -> bool:
+    """edges is the swh edge restriction, e.g. "rev:rev,rev:dir", "*" or empty for all"""
+    if not edges or edges == "*":
+        return True
+    source_type, target_type = source.split(":")[2], target.split(":")[2]
+    for edge in edges.split(","):
+        src, _, dst = edge.partition(":")
+        if src in ("*", source_type) and dst in ("*", target_type):
+            return True
+    return False
+
+
+class FakeTraversalService(swhgraph_grpc.TraversalServiceServicer):
+    def __init__(self, graph: SampledGraph):
+        self.graph = graph
+        self.rng = random.Random(FAKE_GRAPH_SEED)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failed = 0
+        self.nodes_sent = 0
+
+    def answer(self, context, nodes_sent: int = 0):
+        """counts the request, sleeps the configured latency and fails some on purpose"""
+        with self.lock:
+            self.requests += 1
+            self.nodes_sent += nodes_sent
+            delay = FAKE_GRAPH_LATENCY_MS + self.rng.random() * FAKE_GRAPH_JITTER_MS
+            fail = self.rng.random() < FAKE_GRAPH_ERROR_RATE
+            if fail:
+                self.failed += 1
+        if delay:
+            time.sleep(delay / 1000)
+        if fail:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "injected failure")
+
+    def node(self, node_swhid: str, context) -> swhgraph.Node:
+        node = self.graph.nodes.get(node_swhid)
+        if node is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Unknown SWHID: {node_swhid}")
+        return node
+
+    def GetNode(self, request, context):
+        self.answer(context, nodes_sent=1)
+        node = self.node(request.swhid, context)
+        return masked(node, request.mask if request.HasField("mask") else None)
+
+    def Stats(self, request, context):
+        self.answer(context)
+        return swhgraph.StatsResponse(
+            num_nodes=len(self.graph.nodes),
+            num_edges=sum(len(n.successor) for n in self.graph.nodes.values()),
+        )
+
+    def Traverse(self, request, context):
+        """breadth first, honours direction, edges, depths, node types and limits"""
+        self.answer(context)
+        backward = request.direction == swhgraph.GraphDirection.BACKWARD
+        predecessors = self.graph.predecessors() if backward else None
+        types = "*"
+        if request.HasField("return_nodes") and request.return_nodes.types:
+            types = request.return_nodes.types
+        types = None if types == "*" else set(types.split(","))
+        # ignored nodes are handled as if they were not in the graph
+        ignored = set(request.ignore_node)
+        mask = request.mask if request.HasField("mask") else None
+
+        queue = deque()
+        seen = set()
+        for src in request.src:
+            self.node(src, context)
+            if src not in ignored and src not in seen:
+                queue.append((src, 0))
+                seen.add(src)
+        edges = 0
+        matched = 0
+        while queue:
+            current, depth = queue.popleft()
+            node = self.graph.nodes[current]
+            if depth >= request.min_depth and (
+                types is None or current.split(":")[2] in types
+            ):
+                yield masked(node, mask)
+                matched += 1
+                with self.lock:
+                    self.nodes_sent += 1
+                if request.max_matching_nodes and matched >= request.max_matching_nodes:
+                    return
+            if request.HasField("max_depth") and depth >= request.max_depth:
+                continue
+            if backward:
+                neighbours = predecessors.get(current, [])
+            else:
+                neighbours = [successor.swhid for successor in node.successor]
+            for neighbour in neighbours:
+                source, target = (
+                    (neighbour, current) if backward else (current, neighbour)
+                )
+                if not edge_allowed(request.edges, source, target):
+                    continue
+                edges += 1
+                if request.max_edges and edges > request.max_edges:
+                    return
+                if neighbour in seen or neighbour in ignored:
+                    continue
+                if neighbour in self.graph.nodes:
+                    seen.add(neighbour)
+                    queue.append((neighbour, depth + 1))
+
+    def report(self):
+        last_requests = 0
+        last = time.perf_counter()
+        while True:
+            time.sleep(FAKE_GRAPH_REPORT_EVERY)
+            now = time.perf_counter()
+            with self.lock:
+                requests, failed, nodes_sent = (
+                    self.requests,
+                    self.failed,
+                    self.nodes_sent,
+                )
+            if requests != last_requests:
+                logging.info(
+                    f"{requests} requests ({failed} failed), {nodes_sent} nodes sent, "
+                    f"{(requests - last_requests) / (now - last):.0f} requests/s"
+                )
+            last_requests, last = requests, now
+
+
+def load_graph() -> SampledGraph:
+    repo_path = FAKE_GRAPH_REPO
+    if not repo_path:
+        # imported here, the benchmark settings only matter for the synthetic repository
+        from benchmark import synthetic_repository
+
+        _, repo_path = synthetic_repository()
+    logging.info(f"sampling the graph from {repo_path}")
+    start = time.perf_counter()
+    graph = SampledGraph(pygit2.Repository(repo_path), FAKE_GRAPH_LIMIT)
+    logging.info(
+        f"{graph.revisions} revisions, {len(graph.nodes)} nodes loaded in "
+        f"{time.perf_counter() - start:.1f}s, origin {graph.origin}"
+    )
+    return graph
+
+
+def serve():
+    service = FakeTraversalService(load_graph())
+    server = grpc.server(ThreadPoolExecutor(max_workers=FAKE_GRAPH_WORKERS))
+    swhgraph_grpc.add_TraversalServiceServicer_to_server(service, server)
+    server.add_insecure_port(FAKE_GRAPH_BIND)
+    server.start()
+    logging.info(f"serving on {FAKE_GRAPH_BIND}")
+    threading.Thread(target=service.report, daemon=True).start()
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(grace=1)
+    logging.info(
+        f"{service.requests} requests ({service.failed} failed), "
+        f"{service.nodes_sent} nodes sent"
+    )
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,12 +1,24 @@
 import logging
 import subprocess
-import csv
-import orjson
 import os
+import re
+from datetime import datetime, timedelta
 
 from pygit2 import Repository
 
+from batch_pool import OrderedBatchPool
+from columnar_io import (
+    BatchedWriter,
+    MAINTAINERS_HISTORY_SCHEMA,
+    MAINTAINERS_SNAPSHOTS_SCHEMA,
+)
+import instrumentation
+
 kernel_path = os.getenv("KERNEL_PATH", ".")
+# branch whose MAINTAINERS history is read
+MAINTAINERS_BRANCH = os.getenv("MAINTAINERS_BRANCH", "master")
+MAINTAINERS_WORKERS = int(os.getenv("MAINTAINERS_WORKERS", os.cpu_count()))
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", "250"))
 DEBUG = os.getenv("DEBUG", "false")
 level = logging.INFO
 if DEBUG != "false":
@@ -21,71 +33,147 @@ logging.basicConfig(
 
 def read_maintainers_file_commits(repo: Repository) -> list[str]:
     git_hystory_result = subprocess.run(
-        ["git", "--no-pager", "log", "--follow", '--pretty=format:"%H"', "MAINTAINERS"],
-        cwd=repo.workdir,
+        [
+            "git",
+            "--git-dir",
+            repo.path,
+            "--no-pager",
+            "log",
+            "--follow",
+            "--pretty=format:%H",
+            MAINTAINERS_BRANCH,
+            "--",
+            "MAINTAINERS",
+        ],
         capture_output=True,
         text=True,
     )
     if git_hystory_result.returncode != 0:
-        logging.error(git_hystory_result.stderr)
-        return
-    commits = git_hystory_result.stdout.strip().split("\n")
+        raise RuntimeError(
+            f"git log of MAINTAINERS failed: {git_hystory_result.stderr.strip()}"
+        )
+    commits = git_hystory_result.stdout.split()
     return commits
 
 
-def checkout_and_read_file(repo: Repository, sha: str) -> list[str]:
-    checkout = subprocess.run(
-        ["git", "checkout", sha],
-        cwd=repo.workdir,
-        capture_output=True,
-        text=True,
-    )
+# repository of the current process, each worker opens its own
+_repo = None
 
-    if checkout.returncode != 0:
-        logging.error(checkout.stderr)
-        return
 
-    maintain_emails = subprocess.run(
-        ["awk", "/^M:|^R:/{print $NF}", "MAINTAINERS"],
-        cwd=repo.workdir,
-        capture_output=True,
-        text=True,
+def open_repository(kernel_path: str):
+    global _repo
+    _repo = Repository(kernel_path)
+
+
+# matches field lines of a section, like "M:\tName <email>"
+FIELD_LINE = re.compile(r"^[A-Z]:\s")
+
+
+def parse_maintainers(content: str) -> list[tuple[str, str]]:
+    """
+    Returns the (section, email) pairs of the M: and R: lines of a MAINTAINERS file.
+    A section starts at a title line, followed by its field lines, and ends at a blank line.
+    Emails are the last word of the line, without the angle brackets.
+    """
+    pairs = []
+    section = ""
+    for line in content.splitlines():
+        if FIELD_LINE.match(line):
+            if line.startswith(("M:", "R:")):
+                email = line.split()[-1].replace("<", "").replace(">", "")
+                pairs.append((section, email))
+        elif line.strip():
+            section = line.strip()
+    return pairs
+
+
+# reads the MAINTAINERS blob of a commit straight from the object database
+def read_maintainers_at(sha: str) -> tuple[datetime, list[tuple[str, str]]] | None:
+    commit = _repo.get(sha)
+    try:
+        blob = commit.tree["MAINTAINERS"]
+    except KeyError:
+        logging.warning(f"MAINTAINERS not found in the tree of {sha}")
+        return None
+    committer_date = datetime.utcfromtimestamp(commit.commit_time) + timedelta(
+        minutes=commit.commit_time_offset
     )
-    if maintain_emails.returncode != 0:
-        logging.error(maintain_emails.stderr)
-        return
-    emails = (
-        maintain_emails.stdout.strip().replace("<", "").replace(">", "").split("\n")
+    return committer_date, parse_maintainers(
+        blob.data.decode("utf-8", errors="replace")
     )
-    return orjson.dumps(emails).decode()
+
+
+def read_maintainers_batch(shas: list[str]) -> list[tuple | None]:
+    return [read_maintainers_at(sha) for sha in shas]
+
+
+def as_entries(pairs) -> list[dict]:
+    return [{"section": section, "email": email} for section, email in sorted(pairs)]
 
 
 def run(kernel_path: str):
-    tags_file = open(
-        "./data/maintainers.csv", "w", newline="", buffering=1, encoding="utf-8"
-    )
-    tags_writer = csv.writer(
-        tags_file, delimiter="|", quoting=csv.QUOTE_ALL, lineterminator="\n"
+    # each version stores the entries added and removed since the previous one,
+    # with a full snapshot every SNAPSHOT_EVERY versions
+    history_writer = BatchedWriter("maintainers_history", MAINTAINERS_HISTORY_SCHEMA)
+    snapshots_writer = BatchedWriter(
+        "maintainers_snapshots", MAINTAINERS_SNAPSHOTS_SCHEMA
     )
 
-    tags_writer.writerow(["commit", "maintainers"])
-
     repo = Repository(kernel_path)
 
-    branch = repo.lookup_branch("master")
-    ref = repo.lookup_reference(branch.name)
-    repo.checkout(ref)
-
     logging.info("reading all relevant commits")
-    commits = read_maintainers_file_commits(repo)
-
-    logging.info("checking out commits")
-    for commit in commits:
-        emails = checkout_and_read_file(repo, commit.strip().strip('"').strip(""))
-        tags_writer.writerow([commit, emails])
-        logging.info(f"commit row written: {commit}")
-    tags_file.close()
+    with instrumentation.phase("git_log"):
+        commits = read_maintainers_file_commits(repo)
+    # oldest first, deltas are computed in order
+    commits.reverse()
+
+    previous = set()
+    version = 0
+
+    def write_batch(shas: list[str], results: list[tuple | None]):
+        nonlocal previous, version
+        for commit, result in zip(shas, results):
+            if result is None:
+                instrumentation.count("maintainers_missing")
+                continue
+            committer_date, pairs = result
+            current = set(pairs)
+            history_writer.writerow(
+                [
+                    version,
+                    commit,
+                    committer_date,
+                    as_entries(current - previous),
+                    as_entries(previous - current),
+                ]
+            )
+            if version % SNAPSHOT_EVERY == 0:
+                snapshots_writer.writerow(
+                    [version, commit, committer_date, as_entries(current)]
+                )
+            previous = current
+            version += 1
+        logging.info(f"{version} versions written, last: {shas[-1]}")
+
+    # the file is read from each commit tree by MAINTAINERS_WORKERS processes, nothing is checked out
+    logging.info(f"reading MAINTAINERS from {len(commits)} commits")
+    with (
+        instrumentation.phase("read_maintainers"),
+        OrderedBatchPool(
+            read_maintainers_batch,
+            write_batch,
+            workers=MAINTAINERS_WORKERS,
+            batch_size=64,
+            initializer=open_repository,
+            initargs=(kernel_path,),
+        ) as pool,
+    ):
+        for commit in commits:
+            pool.submit(commit)
+    history_writer.close()
+    snapshots_writer.close()
 
 
 if __name__ == "__main__":
+    instrumentation.start("maintainers")
     run(kernel_path)
@@ -1,10 +1,9 @@
 import logging
 import os
 import sys
-import re
-import csv
 from datetime import datetime, timedelta
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 
 import orjson
@@ -12,7 +11,20 @@ import grpc
 import swh.graph.grpc.swhgraph_pb2 as swhgraph
 import swh.graph.grpc.swhgraph_pb2_grpc as swhgraph_grpc
 
-# from google.protobuf.field_mask_pb2 import FieldMask
+from columnar_io import (
+    BatchedWriter,
+    data_path,
+    read_rows,
+    COMMIT_TREES_SCHEMA,
+    COMMITS_SCHEMA,
+    TREES_SCHEMA,
+)
+from dataset_manifest import replace_atomically
+from parse_attributions import attribution_pool
+import instrumentation
+
+from google.protobuf.field_mask_pb2 import FieldMask
+
 # from google.protobuf.json_format import MessageToDict
 
 
@@ -27,8 +39,20 @@ KERNEL_TREE = os.getenv(
 # if provided, the script will skip searching by origin (kernel tree)
 INITIAL_NODE = os.getenv("INITIAL_NODE", "")
 DEFAULT_BRANCH = os.getenv("DEFAULT_BRANCH", "master")
+# comma separated origins crawled in one run, each optionally followed by "#<branch>"
+# (DEFAULT_BRANCH otherwise), e.g. "<mainline url>,<linux-next url>#master".
+# Commits shared by the trees are fetched and parsed once
+KERNEL_TREES = os.getenv("KERNEL_TREES", KERNEL_TREE)
+
+# concurrent GetNode requests used to resolve the snapshot releases
+RELEASE_WORKERS = int(os.getenv("RELEASE_WORKERS", "32"))
+# part of the snapshot cache file name, bumped when the cached contents change.
+# 2: release keys are the full sha1, lstrip("swh:1:rev:") used to eat their leading chars
+SNAPSHOT_CACHE_VERSION = 2
 
 DEBUG = os.getenv("DEBUG", "false")
+# fetches and logs every non-revision successor, one extra request per node
+DEBUG_RESOLVE_NODES = os.getenv("DEBUG_RESOLVE_NODES", "false") != "false"
 level = logging.INFO
 if DEBUG != "false":
     level = logging.DEBUG
@@ -79,149 +103,210 @@ class UniqueDeque:
         return f"UniqueDeque({list(self._deque)})"
 
 
-def extract_attributions(commit_message) -> (list[dict], list[str]):
-    """
-    Parses a git commit message and extracts all personal attributions.
+# builds the output row for a node, the attributions column is filled by the parsing pool
+def commit_record(current_node_response, tag_map) -> tuple:
+    commit_sha1 = current_node_response.swhid.removeprefix("swh:1:rev:")
+    row = [
+        # commit sha1
+        commit_sha1,
+        # committer_date
+        datetime.utcfromtimestamp(current_node_response.rev.committer_date)
+        + timedelta(minutes=current_node_response.rev.committer_date_offset),
+        # author_date
+        datetime.utcfromtimestamp(current_node_response.rev.author_date)
+        + timedelta(minutes=current_node_response.rev.author_date_offset),
+        tag_map.get(commit_sha1),
+    ]
+    return (row, current_node_response.swhid, current_node_response.rev.message)
+
+
+def write_commits(writer: BatchedWriter, records, attributions_list):
+    writer.writerows(
+        [
+            [
+                *row[:3],
+                # attributions: dict with authors, acks, reviews...
+                attributions,
+                # tag
+                row[3],
+                # diffs when available in the graph
+                # 0,
+                # 0,
+            ]
+            for (row, _, _), attributions in zip(records, attributions_list)
+        ]
+    )
 
-    Args:
-        commit_message (str): The full git commit message.
 
-    Returns:
-        list: A list of dictionaries, where each dictionary contains
-              'type' (e.g., 'Signed-off-by'), 'name', and 'email' for each attribution found.
+def resolve_snapshot(stub, snapshot_swhid: str) -> tuple[list[list[str]], dict]:
     """
-    attributions = []
-    # This regex looks for lines starting with "Word-by:"
-    # followed by a name (can contain various characters), and then an email in angle brackets.
-    # It captures the "Word-by" type, the name, and the email separately.
-    # The pattern is compiled with MULTILINE to match '^' at the start of each line,
-    # and IGNORECASE to match "Signed-off-by", "signed-off-by", etc.
-    pattern = re.compile(
-        r"^(?P<type>[a-zA-Z\-]+-by):\s*(?P<name>[^<]+?)\s*<(?P<email>[^>]+)>",
-        re.MULTILINE | re.IGNORECASE,
+    Lists the revision branches of a snapshot, and maps the revisions pointed by its
+    releases to the release name.
+    Releases are resolved concurrently, and the result is cached on disk per snapshot,
+    as a snapshot never changes in a given graph export.
+    """
+    snapshot_id = snapshot_swhid.split(":")[-1]
+    cache_path = f"./data/snapshot_{snapshot_id}.v{SNAPSHOT_CACHE_VERSION}.json"
+    if os.path.exists(cache_path):
+        logging.info(f"Loading branches and releases from {cache_path}")
+        with open(cache_path, "rb") as f:
+            cached = orjson.loads(f.read())
+        return cached["branches"], cached["releases"]
+
+    instrumentation.count("grpc_requests")
+    snapshot = stub.GetNode(
+        swhgraph.GetNodeRequest(
+            swhid=snapshot_swhid,
+        )
     )
 
-    # Use finditer to get all non-overlapping matches
-    for match in pattern.finditer(commit_message):
-        attributions.append(
-            {
-                "type": match.group(
-                    "type"
-                ).strip(),  # Extract the attribution type (e.g., 'Signed-off-by')
-                "name": match.group(
-                    "name"
-                ).strip(),  # Extract the name (e.g., 'Author Name')
-                "email": match.group(
-                    "email"
-                ).strip(),  # Extract the email (e.g., 'author.name@email.com')
-            }
-        )
-    return attributions
-
-
-# def extract_links(commit_message):
-#     """
-#     Parses a git commit message and extracts all URLs (links).
-#
-#     Args:
-#         commit_message (str): The full git commit message.
-#
-#     Returns:
-#         list: A list of strings, where each string is a URL found in the message.
-#     """
-#     links = []
-#     # This regex looks for common URL patterns starting with http or https.
-#     # It captures the full URL.
-#     # The pattern is non-greedy to avoid capturing too much if multiple links are on a line.
-#     pattern = re.compile(
-#         r"https?://[^\s<>\"'{}|\\^`[\]]+",
-#         re.IGNORECASE
-#     )
-#
-#     # Use findall to get all non-overlapping matches as a list of strings
-#     links = pattern.findall(commit_message)
-#     return links
-
-
-# there are messages with non utf8 encoding
-# this will try to decode them in utf8, cp1252 utf8 with replace (? char), or ignore with empty string
-def decode_message(swhid: str, input_message: str) -> str:
-    message = ""
-    try:
-        message = input_message.decode("utf-8")
-    except Exception as e:
-        logging.error(
-            f"Failed to decode node message with unicode: {swhid}, message: {input_message}, error: {e}"
-        )
-        try:
-            message = input_message.decode(encoding="cp1252")
-        except Exception as e:
-            logging.error(
-                f"Failed to decode node message with cp1252: {swhid}, message: {input_message}, error: {e}"
+    branches = []
+    releases = []
+    for succ in snapshot.successor:
+        if succ.swhid.startswith("swh:1:rev"):
+            branches.append([succ.label[0].name.decode(), succ.swhid])
+        elif succ.swhid.startswith("swh:1:rel"):
+            releases.append(succ.swhid)
+
+    def get_release(swhid: str):
+        instrumentation.count("grpc_requests")
+        return stub.GetNode(
+            swhgraph.GetNodeRequest(
+                swhid=swhid,
+                mask=FieldMask(paths=["swhid", "successor.swhid", "rel.name"]),
             )
-            try:
-                message = input_message.decode("utf-8", errors="replace")
-            except Exception as e:
-                logging.error(
-                    f"Failed to decode node message with utf-8 using replace mode: {swhid}, message: {input_message}, error: {e}"
-                )
-                # if even replace fails, ignore the message
-                message = ""
-    return message
+        )
 
+    logging.info(f"Resolving {len(releases)} releases")
+    rev_rel_map = {}
+    # grpc stubs are thread safe, map keeps the snapshot order of the releases
+    with ThreadPoolExecutor(max_workers=RELEASE_WORKERS) as executor:
+        for tag in executor.map(get_release, releases):
+            for succ in tag.successor:
+                rev_rel_map[succ.swhid.removeprefix("swh:1:rev:")] = (
+                    tag.rel.name.decode("utf-8")
+                )
 
-def write_commit(writer: csv.writer, current_node_response, tag_map):
-    attributions = extract_attributions(
-        decode_message(current_node_response.swhid, current_node_response.rev.message)
-    )
-    commit_sha1 = current_node_response.swhid.lstrip("swh:1:rev:")
-    tag = tag_map.get(commit_sha1)
-    writer.writerow(
-        [
-            # commit sha1
-            commit_sha1,
-            # committer_date
-            (
-                datetime.utcfromtimestamp(current_node_response.rev.committer_date)
-                + timedelta(minutes=current_node_response.rev.committer_date_offset)
-            ).strftime("%Y-%m-%dT%H:%M:%S"),
-            # author_date
-            (
-                datetime.utcfromtimestamp(current_node_response.rev.author_date)
-                + timedelta(minutes=current_node_response.rev.author_date_offset)
-            ).strftime("%Y-%m-%dT%H:%M:%S"),
-            # attributions: dict with authors, acks, reviews...
-            orjson.dumps(attributions).decode(),
-            tag,
-            # diffs when available in the graph
-            # 0,
-            # 0,
-        ]
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps({"branches": branches, "releases": rev_rel_map}))
+
+    # an interrupted run must not leave a truncated cache for the next one to load
+    replace_atomically(cache_path, write)
+
+    return branches, rev_rel_map
+
+
+def parse_trees(trees: str) -> list[tuple[str, str, str]]:
+    """(name, origin, branch) of every tree, named after its repository and branch"""
+    parsed = []
+    for tree in trees.split(","):
+        tree = tree.strip()
+        if not tree:
+            continue
+        origin, _, branch = tree.partition("#")
+        branch = branch or DEFAULT_BRANCH
+        name = f"{origin.rstrip('/').rsplit('/', 1)[-1].removesuffix('.git')}/{branch}"
+        if any(name == other for other, _, _ in parsed):
+            name = f"{name}-{len(parsed)}"
+        parsed.append((name, origin, branch))
+    # tree ids are bits of an int64
+    if len(parsed) > 63:
+        raise ValueError("at most 63 trees can be crawled in one run")
+    return parsed
+
+
+def latest_snapshot(stub, origin: str) -> str:
+    origin_sha1 = hashlib.sha1(origin.encode("utf-8")).hexdigest()
+
+    # or look for initial node, by loading the ORIGIN
+    # load releases and last commit from origin
+    instrumentation.count("grpc_requests")
+    origin_node = stub.GetNode(
+        swhgraph.GetNodeRequest(
+            swhid=f"swh:1:ori:{origin_sha1}",
+            # mask=FieldMask(paths=["swhid", "rev.message", "rev.author"]),
+        )
     )
+    # print(origin_node)
+    # get the last snapshot
+    last_snapshot = None
+    for succ in origin_node.successor:
+        if last_snapshot is None:
+            last_snapshot = succ
+        else:
+            # TODO: check if there are other labels
+            visit_timestamp = last_snapshot.label[0].visit_timestamp
+            suucc_timestamp = succ.label[0].visit_timestamp
+            if suucc_timestamp > visit_timestamp:
+                last_snapshot = succ
+    return last_snapshot.swhid
+
+
+def print_latest_snapshots():
+    """
+    Prints the latest snapshot of every tree, hashed by pipeline.py to crawl again
+    when the graph export has a newer one.
+    """
+    with grpc.insecure_channel(GRAPH_GRPC_SERVER) as channel:
+        stub = swhgraph_grpc.TraversalServiceStub(channel)
+        for name, origin, _ in parse_trees(KERNEL_TREES):
+            print(name, latest_snapshot(stub, origin))
+
+
+def previous_membership(trees: list[tuple[str, str, str]]) -> dict[str, int]:
+    """
+    Tree bitmaps of the previous run, when it crawled the same trees.
+    Preloaded commits are not walked through again, so their ancestors keep these.
+    """
+    if not os.path.exists(data_path("trees")) or not os.path.exists(
+        data_path("commit_trees")
+    ):
+        return {}
+    previous = [row["name"] for row in read_rows("trees", TREES_SCHEMA)]
+    if previous != [name for name, _, _ in trees]:
+        logging.warning(
+            "the trees changed since the previous run, "
+            "commits behind the preloaded ones only get the trees reaching them"
+        )
+        return {}
+    return {
+        row["commit"]: row["trees"]
+        for row in read_rows("commit_trees", COMMIT_TREES_SCHEMA)
+    }
+
+
+def write_membership(trees, heads: list[list[str]], membership: dict[str, int]):
+    with BatchedWriter("trees", TREES_SCHEMA) as trees_writer:
+        trees_writer.writerows(
+            [
+                [tree_id, name, origin, branch, " ".join(tree_heads)]
+                for tree_id, ((name, origin, branch), tree_heads) in enumerate(
+                    zip(trees, heads)
+                )
+            ]
+        )
+    with BatchedWriter("commit_trees", COMMIT_TREES_SCHEMA) as membership_writer:
+        membership_writer.writerows([[sha, bits] for sha, bits in membership.items()])
 
 
 def main():
-    file = open("./data/commits.csv", "w", newline="", buffering=1, encoding="utf-8")
-    writer = csv.writer(file, delimiter="|", quoting=csv.QUOTE_ALL, lineterminator="\n")
-    writer.writerow(
-        [
-            "commit",
-            "committer_date",
-            "author_date",
-            "attributions",
-            "tag",
-            # "diff_plus",
-            # "diff_minus",
-        ]
-    )
+    writer = BatchedWriter("commits", COMMITS_SCHEMA)
+    trees = parse_trees(KERNEL_TREES)
 
     node_num = 0
+    # revisions fetched by this run, or by previous runs when preloaded
     visited = set()
-    queue = UniqueDeque()
+    # revisions pointed by the fetched ones, kept while other trees may walk through them
+    parents = {}
+    # bitmap of the trees reaching each commit, bit i for the i-th tree
+    membership = {}
 
     # can be used with :
     # $ tail -n +2 file.csv | awk -F'|' '{print $1}' | PRE_LOAD_COMMITS_FROM_STDIN=true uv run python grpc_script.py
     # skip the header line  | print only the first column
+    # or, with OUTPUT_FORMAT=parquet:
+    # $ python -c 'import polars as pl; print(*pl.read_parquet("commits.parquet")["commit"], sep="\n")' | ...
 
     if PRE_LOAD_COMMITS_FROM:
         logging.info("Reading existing visited nodes")
@@ -230,128 +315,154 @@ def main():
             last_node = "swh:1:rev:{}".format(line.strip().strip('"'))
             visited.add(last_node)
         logging.info(f"LastNode read from stdin: {last_node}")
-        queue = UniqueDeque([last_node])
+        membership = previous_membership(trees)
+
+    # attribution parsing runs in a process pool, off the traversal loop
+    pool = attribution_pool(
+        lambda records, attributions: write_commits(writer, records, attributions)
+    )
 
     with grpc.insecure_channel(GRAPH_GRPC_SERVER) as channel:
         stub = swhgraph_grpc.TraversalServiceStub(channel)
 
-        origin_sha1 = hashlib.sha1(KERNEL_TREE.encode("utf-8")).hexdigest()
-
-        # or look for initial node, by loading the ORIGIN
-        # load releases and last commit from origin
-        origin_node = stub.GetNode(
-            swhgraph.GetNodeRequest(
-                swhid=f"swh:1:ori:{origin_sha1}",
-                # mask=FieldMask(paths=["swhid", "rev.message", "rev.author"]),
-            )
-        )
-        # print(origin_node)
-        # get the last snapshot
-        last_snapshot = None
-        for succ in origin_node.successor:
-            if last_snapshot is None:
-                last_snapshot = succ
-            else:
-                # TODO: check if there are other labels
-                visit_timestamp = last_snapshot.label[0].visit_timestamp
-                suucc_timestamp = succ.label[0].visit_timestamp
-                if suucc_timestamp > visit_timestamp:
-                    last_snapshot = succ
-        last_snapshot = stub.GetNode(
-            swhgraph.GetNodeRequest(
-                swhid=last_snapshot.swhid,
-            )
-        )
         rev_rel_map = {}
-
-        logging.info("Lokking for starting commit and building release map")
-
-        for succ in last_snapshot.successor:
-            # if succ.swhid.startswith("swh:1:rev"):
-            if succ.swhid.startswith("swh:1:rev") and succ.label[
-                0
-            ].name.decode().endswith(DEFAULT_BRANCH):
-                print(f"INITIAL_NODE will be {succ}, {succ.label[0].name.decode()}")
-                queue.append(succ.swhid)
-            # TODO: pick commits from other branches too ?
-
-            elif succ.swhid.startswith("swh:1:rel"):
-                tag = stub.GetNode(
-                    swhgraph.GetNodeRequest(
-                        swhid=succ.swhid,
-                    )
+        heads = []
+        for name, origin, branch in trees:
+            logging.info(
+                f"{name}: looking for starting commit and building release map"
+            )
+            with instrumentation.phase("resolve_snapshot"):
+                branches, tree_releases = resolve_snapshot(
+                    stub, latest_snapshot(stub, origin)
                 )
+            # the releases of the first trees win
+            rev_rel_map = {**tree_releases, **rev_rel_map}
 
-                for succ in tag.successor:
-                    rev_rel_map[succ.swhid.lstrip("swh:1:rev:")] = tag.rel.name.decode(
-                        "utf-8"
-                    )
-            # print(rev_rel_map)
-            # print(last_snapshot)
+            tree_heads = []
+            for branch_name, swhid in branches:
+                if branch_name.endswith(branch):
+                    print(f"INITIAL_NODE will be {swhid}, {branch_name}")
+                    tree_heads.append(swhid)
+                # TODO: pick commits from other branches too ?
+            heads.append(tree_heads)
 
         # start from INITIAL_NODE if set
         if INITIAL_NODE:
-            queue = UniqueDeque([INITIAL_NODE])
-
-        logging.info(f"Preparing BFS with {queue}")
-        while queue:
-            try:
-                current_node = queue.popleft()
-                logging.debug(f"Popped {current_node}")
-
-                if current_node not in visited:
-                    visited.add(current_node)
-                    logging.info(f"Visiting {current_node}")
-
+            heads[0] = [INITIAL_NODE]
+
+        # every tree is walked from its head, commits fetched by a previous tree are
+        # walked through from memory, so a tree only costs the requests of its own commits
+        for tree_id, (name, _, _) in enumerate(trees):
+            bit = 1 << tree_id
+            keep_parents = tree_id < len(trees) - 1
+            queue = UniqueDeque(heads[tree_id])
+            reached = set()
+            fetched_before = node_num
+            logging.info(f"Preparing BFS of {name} with {queue}")
+            with instrumentation.phase("bfs"):
+                while queue:
                     try:
-                        # GetNode details from graph
-                        current_node_response = stub.GetNode(
-                            swhgraph.GetNodeRequest(
-                                swhid=current_node,
-                                # mask=FieldMask(paths=["swhid", "rev.message", "rev.author"]),
+                        current_node = queue.popleft()
+                        logging.debug(f"Popped {current_node}")
+
+                        if current_node in reached:
+                            continue
+                        reached.add(current_node)
+                        commit_sha1 = current_node.removeprefix("swh:1:rev:")
+
+                        successors = parents.get(current_node)
+                        if successors is None and current_node in visited:
+                            # preloaded, the previous run walked behind it
+                            instrumentation.count("commits_preloaded")
+                            membership[commit_sha1] = (
+                                membership.get(commit_sha1, 0) | bit
                             )
-                        )
-                    except Exception as e:
-                        logging.exception(
-                            f"skipped node {current_node}  because of exception: {e}"
-                        )
-                        continue
-
-                    # logging.debug(f"Current node response: {current_node_response}")
-                    node_num += 1
-
-                    for succ in current_node_response.successor:
-                        logging.debug(f"successor: {succ}")
-                        # filter only revisions
-                        if (
-                            succ.swhid.startswith("swh:1:rev")
-                            and succ.swhid not in visited
-                        ):
-                            queue.append(succ.swhid)
-                        elif DEBUG != "false" and succ.swhid not in visited:
-                            logging.debug(f"Found a non-revision node: {succ.swhid}")
-                            if not succ.swhid.startswith("swh:1:dir"):
-                                nodeInfo = stub.GetNode(
+                            continue
+
+                        if successors is not None:
+                            instrumentation.count("commits_from_memory")
+                        else:
+                            visited.add(current_node)
+                            logging.info(f"Visiting {current_node}")
+
+                            try:
+                                # GetNode details from graph
+                                instrumentation.count("grpc_requests")
+                                current_node_response = stub.GetNode(
                                     swhgraph.GetNodeRequest(
-                                        swhid=succ.swhid,
+                                        swhid=current_node,
                                         # mask=FieldMask(paths=["swhid", "rev.message", "rev.author"]),
                                     )
                                 )
-                                logging.debug(
-                                    f"Non dir/revision node found: {nodeInfo}"
+                            except Exception as e:
+                                logging.exception(
+                                    f"skipped node {current_node}  because of exception: {e}"
+                                )
+                                continue
+
+                            # logging.debug(f"Current node response: {current_node_response}")
+                            node_num += 1
+                            instrumentation.count("commits_fetched")
+                            if instrumentation.PROFILE:
+                                instrumentation.count(
+                                    "grpc_response_bytes",
+                                    current_node_response.ByteSize(),
                                 )
 
-                    # add current commit to writer
-                    write_commit(writer, current_node_response, rev_rel_map)
+                            successors = []
+                            for succ in current_node_response.successor:
+                                logging.debug(f"successor: {succ}")
+                                # filter only revisions
+                                if succ.swhid.startswith("swh:1:rev"):
+                                    successors.append(succ.swhid)
+                                elif DEBUG_RESOLVE_NODES and succ.swhid not in visited:
+                                    logging.debug(
+                                        f"Found a non-revision node: {succ.swhid}"
+                                    )
+                                    if not succ.swhid.startswith("swh:1:dir"):
+                                        instrumentation.count("grpc_requests")
+                                        nodeInfo = stub.GetNode(
+                                            swhgraph.GetNodeRequest(
+                                                swhid=succ.swhid,
+                                                # mask=FieldMask(paths=["swhid", "rev.message", "rev.author"]),
+                                            )
+                                        )
+                                        logging.debug(
+                                            f"Non dir/revision node found: {nodeInfo}"
+                                        )
+                            if keep_parents:
+                                parents[current_node] = successors
+
+                            # queue current commit for parsing, rows are written in visit order
+                            pool.submit(
+                                commit_record(current_node_response, rev_rel_map)
+                            )
 
-            except Exception as e:
-                logging.exception(e)
-                break
+                        membership[commit_sha1] = membership.get(commit_sha1, 0) | bit
+                        for successor in successors:
+                            if successor not in reached:
+                                queue.append(successor)
 
-            if node_num > LIMIT and LIMIT > 0:
-                break
-    file.close()
+                    except Exception as e:
+                        logging.exception(e)
+                        break
+
+                    if node_num > LIMIT and LIMIT > 0:
+                        break
+            logging.info(
+                f"{name}: {len(reached)} commits, {node_num - fetched_before} fetched"
+            )
+    # waits for the messages still being parsed
+    with instrumentation.phase("parse_drain"):
+        pool.close()
+    writer.close()
+    with instrumentation.phase("write_membership"):
+        write_membership(trees, heads, membership)
 
 
 if __name__ == "__main__":
+    if "--latest-snapshots" in sys.argv:
+        print_latest_snapshots()
+        sys.exit(0)
+    instrumentation.start("grpc")
     main()
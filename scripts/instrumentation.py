@@ -0,0 +1,186 @@
+import atexit
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import orjson
+
+from dataset_manifest import replace_atomically
+
+# opt-in profiling of the pipeline scripts, PROFILE=true or --profile.
+# Each phase records its wall and cpu time and the memory of the process around it,
+# counters add up rows, requests and bytes, and everything is written at exit to
+# ./data/profile_<script>.json
+PROFILE = os.getenv("PROFILE", "false") != "false" or "--profile" in sys.argv
+# also traces the python allocations of every phase. Slower, and blind to the memory
+# allocated by polars and arrow, which the rss figures include
+PROFILE_TRACEMALLOC = os.getenv("PROFILE_TRACEMALLOC", "false") != "false"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+_lock = threading.Lock()
+_phases = {}
+_counters = defaultdict(int)
+# tracemalloc peaks of the open phases, innermost last
+_open_peaks = []
+_started = None
+
+
+def _rss_bytes() -> int:
+    """current resident memory, the linux peak (ru_maxrss) only grows"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _max_rss_bytes() -> int:
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def start(script: str):
+    """Starts profiling the process if enabled, called once from __main__."""
+    global _started
+    if not PROFILE or _started is not None:
+        return
+    _started = (
+        datetime.now(timezone.utc),
+        time.perf_counter(),
+        time.process_time(),
+    )
+    if PROFILE_TRACEMALLOC:
+        tracemalloc.start()
+    # registered by the main process only, pool workers import the script too
+    atexit.register(write_summary, script)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Times the block and records the memory of the process around it.
+    Phases with the same name add up, nested phases are also counted in the outer ones.
+    """
+    if _started is None:
+        yield
+        return
+
+    if PROFILE_TRACEMALLOC:
+        if _open_peaks:
+            _open_peaks[-1] = max(_open_peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        _open_peaks.append(0)
+    rss_before = _rss_bytes()
+    max_rss_before = _max_rss_bytes()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        rss_after = _rss_bytes()
+        max_rss_after = _max_rss_bytes()
+        traced_peak = None
+        if PROFILE_TRACEMALLOC:
+            traced_peak = max(_open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if _open_peaks:
+                _open_peaks[-1] = max(_open_peaks[-1], traced_peak)
+
+        with _lock:
+            stats = _phases.setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "rss_growth_bytes": 0,
+                    # by how much the phase raised the peak rss of the process
+                    "peak_rss_growth_bytes": 0,
+                    "rss_after_bytes": 0,
+                },
+            )
+            stats["calls"] += 1
+            stats["wall_seconds"] += wall
+            stats["cpu_seconds"] += cpu
+            stats["rss_growth_bytes"] += rss_after - rss_before
+            stats["peak_rss_growth_bytes"] += max_rss_after - max_rss_before
+            stats["rss_after_bytes"] = max(stats["rss_after_bytes"], rss_after)
+            if traced_peak is not None:
+                stats["traced_peak_bytes"] = max(
+                    stats.get("traced_peak_bytes", 0), traced_peak
+                )
+        logging.debug(
+            f"{name}: {wall:.2f}s wall, {cpu:.2f}s cpu, "
+            f"rss {rss_before / 2**20:.0f} -> {rss_after / 2**20:.0f} MiB"
+        )
+
+
+def count(name: str, value: int = 1):
+    """Adds value to a counter, safe to call from threads."""
+    if _started is None:
+        return
+    with _lock:
+        _counters[name] += value
+
+
+def collect(lf, name: str, **kwargs):
+    """lf.collect(**kwargs) as a phase, counting the rows of the result in <name>_rows"""
+    with phase(name):
+        df = lf.collect(**kwargs)
+    count(f"{name}_rows", df.height)
+    return df
+
+
+def write_summary(script: str):
+    started_at, wall, cpu = _started
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    summary = {
+        "script": script,
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "wall_seconds": round(time.perf_counter() - wall, 3),
+        "cpu_seconds": round(time.process_time() - cpu, 3),
+        # pool workers, once they exited
+        "children_cpu_seconds": round(children.ru_utime + children.ru_stime, 3),
+        "max_rss_bytes": own.ru_maxrss * 1024,
+        "children_max_rss_bytes": children.ru_maxrss * 1024,
+        "phases": {
+            name: {
+                key: round(value, 3) if isinstance(value, float) else value
+                for key, value in stats.items()
+            }
+            for name, stats in _phases.items()
+        },
+        "counters": dict(_counters),
+    }
+    if PROFILE_TRACEMALLOC:
+        summary["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+
+    path = f"./data/profile_{script}.json"
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
+
+    os.makedirs("./data", exist_ok=True)
+    replace_atomically(path, write)
+
+    # slowest phases first
+    for name, stats in sorted(
+        _phases.items(), key=lambda item: item[1]["wall_seconds"], reverse=True
+    ):
+        logging.info(
+            f"{name}: {stats['calls']} calls, {stats['wall_seconds']:.2f}s wall, "
+            f"{stats['cpu_seconds']:.2f}s cpu, "
+            f"peak rss +{stats['peak_rss_growth_bytes'] / 2**20:.0f} MiB"
+        )
+    logging.info(f"profile written to {path}")
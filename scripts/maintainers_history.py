@@ -0,0 +1,154 @@
+import bisect
+from datetime import datetime
+
+import polars as pl
+
+from columnar_io import (
+    read_frame,
+    MAINTAINERS_HISTORY_SCHEMA,
+    MAINTAINERS_SNAPSHOTS_SCHEMA,
+)
+
+
+def _pairs(entries: list[dict] | None) -> set[tuple[str, str]]:
+    return {(entry["section"], entry["email"]) for entry in entries or []}
+
+
+class MaintainersHistory:
+    """
+    Replays the maintainers delta log written by get_official_kernel_maintainers.py.
+    The state of a version is rebuilt from the closest snapshot at or before it,
+    plus the deltas that follow it.
+    """
+
+    def __init__(self, history: pl.DataFrame, snapshots: pl.DataFrame):
+        history = history.sort("version")
+        self.versions = history.select("version", "commit", "committer_date")
+        self._added = history["added"].to_list()
+        self._removed = history["removed"].to_list()
+        self._snapshots = {
+            row["version"]: _pairs(row["maintainers"])
+            for row in snapshots.iter_rows(named=True)
+        }
+        self._snapshot_versions = sorted(self._snapshots)
+
+    @classmethod
+    def load(cls) -> "MaintainersHistory":
+        return cls(
+            read_frame("maintainers_history", MAINTAINERS_HISTORY_SCHEMA),
+            read_frame("maintainers_snapshots", MAINTAINERS_SNAPSHOTS_SCHEMA),
+        )
+
+    def state(self, version: int) -> set[tuple[str, str]]:
+        """(section, email) entries of the MAINTAINERS file at a version"""
+        i = bisect.bisect_right(self._snapshot_versions, version) - 1
+        if i < 0:
+            start, state = 0, set()
+        else:
+            start = self._snapshot_versions[i]
+            state = set(self._snapshots[start])
+            start += 1
+        for v in range(start, version + 1):
+            state -= _pairs(self._removed[v])
+            state |= _pairs(self._added[v])
+        return state
+
+    def version_as_of(self, date: datetime) -> int | None:
+        """last version committed at or before date, None before the first one"""
+        versions = self.versions.filter(pl.col("committer_date") <= date)
+        if versions.is_empty():
+            return None
+        return versions["version"].max()
+
+    def as_of(self, date: datetime, section: str | None = None) -> set[str]:
+        """
+        Emails declared in MAINTAINERS at a date, optionally only the ones of a section
+        (its title line, e.g. "DRM DRIVERS").
+        """
+        version = self.version_as_of(date)
+        if version is None:
+            return set()
+        return {
+            email
+            for entry_section, email in self.state(version)
+            if section is None or entry_section == section
+        }
+
+    def sections_as_of(self, date: datetime) -> dict[str, set[str]]:
+        version = self.version_as_of(date)
+        sections = {}
+        if version is not None:
+            for section, email in self.state(version):
+                sections.setdefault(section, set()).add(email)
+        return sections
+
+    def iter_states(self):
+        """yields (version, commit, committer_date, entries) for every version, in order"""
+        state = set()
+        for (version, commit, committer_date), added, removed in zip(
+            self.versions.iter_rows(), self._added, self._removed
+        ):
+            state = (state - _pairs(removed)) | _pairs(added)
+            yield version, commit, committer_date, state
+
+    def emails_by_version(self) -> pl.DataFrame:
+        """one row per version with its de-duplicated list of emails"""
+        rows = [
+            (version, commit, committer_date, sorted({email for _, email in state}))
+            for version, commit, committer_date, state in self.iter_states()
+        ]
+        return pl.DataFrame(
+            rows,
+            schema={
+                "version": pl.UInt32,
+                "commit": pl.String,
+                "committer_date": pl.Datetime("us"),
+                "maintainers": pl.List(pl.String),
+            },
+            orient="row",
+        )
+
+    def membership_intervals(self) -> pl.DataFrame:
+        """
+        One row per stretch of versions an email is declared in, any section:
+        (email, first_version, end_version), end_version being exclusive.
+        Much smaller than the emails of every version, it only grows with the changes.
+        """
+        rows = []
+        opened = {}
+        emails = set()
+        end = 0
+        for version, _, _, state in self.iter_states():
+            current = {email for _, email in state}
+            for email in current - emails:
+                opened[email] = version
+            for email in emails - current:
+                rows.append((email, opened.pop(email), version))
+            emails = current
+            end = version + 1
+        rows.extend((email, first, end) for email, first in opened.items())
+        return pl.DataFrame(
+            rows,
+            schema={
+                "email": pl.String,
+                "first_version": pl.UInt32,
+                "end_version": pl.UInt32,
+            },
+            orient="row",
+        )
+
+    def declared_counts(self) -> pl.DataFrame:
+        """number of distinct emails declared by every version"""
+        return pl.DataFrame(
+            [
+                (version, commit, committer_date, len({email for _, email in state}))
+                for version, commit, committer_date, state in self.iter_states()
+            ],
+            schema={
+                "version": pl.UInt32,
+                "commit": pl.String,
+                "committer_date": pl.Datetime("us"),
+                "declared_maintainers": pl.Int64,
+            },
+            orient="row",
+        )
@@ -0,0 +1,152 @@
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from batch_pool import OrderedBatchPool
+
+# This regex looks for lines starting with "Word-by:"
+# followed by a name (can contain various characters), and then an email in angle brackets.
+# It captures the "Word-by" type, the name, and the email separately.
+# The pattern is compiled with MULTILINE to match '^' at the start of each line,
+# and IGNORECASE to match "Signed-off-by", "signed-off-by", etc.
+# Compiled once at import time, each worker process gets its own copy.
+ATTRIBUTION_PATTERN = re.compile(
+    r"^(?P<type>[a-zA-Z\-]+-by):\s*(?P<name>[^<]+?)\s*<(?P<email>[^>]+)>",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", os.cpu_count()))
+PARSE_BATCH_SIZE = int(os.getenv("PARSE_BATCH_SIZE", "512"))
+
+
+def extract_attributions(commit_message: str) -> list[dict]:
+    """
+    Parses a git commit message and extracts all personal attributions.
+
+    Args:
+        commit_message (str): The full git commit message.
+
+    Returns:
+        list: A list of dictionaries, where each dictionary contains
+              'type' (e.g., 'Signed-off-by'), 'name', and 'email' for each attribution found.
+    """
+    # every attribution line has "-by:" in some casing, skip the regex for messages without any
+    if "y:" not in commit_message and "Y:" not in commit_message:
+        return []
+
+    # Use finditer to get all non-overlapping matches
+    return [
+        {
+            # Extract the attribution type (e.g., 'Signed-off-by')
+            "type": match.group("type").strip(),
+            # Extract the name (e.g., 'Author Name')
+            "name": match.group("name").strip(),
+            # Extract the email (e.g., 'author.name@email.com')
+            "email": match.group("email").strip(),
+        }
+        for match in ATTRIBUTION_PATTERN.finditer(commit_message)
+    ]
+
+
+# def extract_links(commit_message):
+#     """
+#     Parses a git commit message and extracts all URLs (links).
+#
+#     Args:
+#         commit_message (str): The full git commit message.
+#
+#     Returns:
+#         list: A list of strings, where each string is a URL found in the message.
+#     """
+#     links = []
+#     # This regex looks for common URL patterns starting with http or https.
+#     # It captures the full URL.
+#     # The pattern is non-greedy to avoid capturing too much if multiple links are on a line.
+#     pattern = re.compile(
+#         r"https?://[^\s<>\"'{}|\\^`[\]]+",
+#         re.IGNORECASE
+#     )
+#
+#     # Use findall to get all non-overlapping matches as a list of strings
+#     links = pattern.findall(commit_message)
+#     return links
+
+
+# there are messages with non utf8 encoding
+# this will try to decode them in utf8, then cp1252, then utf8 with replace (? char)
+def decode_message(swhid: str, input_message: bytes) -> str:
+    # fast path: the vast majority of messages are valid utf-8
+    try:
+        return input_message.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # the message itself is not logged, it can be arbitrarily large
+        logging.warning(f"Node message is not valid utf-8: {swhid}, error: {e}")
+    try:
+        return input_message.decode("cp1252")
+    except UnicodeDecodeError:
+        # replace mode never fails
+        return input_message.decode("utf-8", errors="replace")
+
+
+# parses a batch of (context, swhid, message) records, runs inside the worker processes
+def parse_records(records: list[tuple]) -> list[list[dict]]:
+    return [
+        extract_attributions(decode_message(swhid, message))
+        for _, swhid, message in records
+    ]
+
+
+def attribution_pool(on_result, workers=PARSE_WORKERS, batch_size=PARSE_BATCH_SIZE):
+    """
+    Returns a pool parsing submitted (context, swhid, message) records off the caller's loop.
+    on_result(records, attributions) is called in submission order.
+    """
+    return OrderedBatchPool(
+        parse_records,
+        on_result,
+        workers=workers,
+        batch_size=batch_size,
+        # workers are not forked from the caller, it may hold grpc channels and threads
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
+
+
+def read_corpus(path: str) -> list[bytes]:
+    # corpus of raw messages separated by NUL bytes, generated with:
+    # $ git -C linux log --format=%B%x00 > messages.bin
+    with open(path, "rb") as f:
+        return [m.strip(b"\n") for m in f.read().split(b"\0") if m.strip()]
+
+
+# benchmark the parsing stage on its own:
+# $ PARSE_WORKERS=8 uv run python parse_attributions.py messages.bin
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    messages = read_corpus(sys.argv[1] if len(sys.argv) > 1 else "./data/messages.bin")
+    records = [(None, str(i), m) for i, m in enumerate(messages)]
+    logging.info(f"Loaded {len(records)} messages")
+
+    def report(mode, elapsed, found):
+        logging.info(
+            f"{mode}: {len(records)} messages in {elapsed:.2f}s "
+            f"({len(records) / elapsed:.0f} msg/s), {found} attributions"
+        )
+
+    start = time.perf_counter()
+    found = sum(len(a) for a in parse_records(records))
+    report("serial", time.perf_counter() - start, found)
+
+    found = 0
+
+    def count(_, results):
+        global found
+        found += sum(len(a) for a in results)
+
+    start = time.perf_counter()
+    with attribution_pool(count) as pool:
+        for record in records:
+            pool.submit(record)
+    report(f"pool ({pool.workers} workers)", time.perf_counter() - start, found)
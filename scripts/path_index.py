@@ -0,0 +1,40 @@
+from columnar_io import (
+    BatchedWriter,
+    COMMIT_PATHS_SCHEMA,
+    PATHS_SCHEMA,
+)
+
+
+class PathIndexWriter:
+    """
+    Records the paths touched by each commit as ids into a dictionary of paths.
+    Writes `commit_paths` (commit, path_ids) as commits are added, and the `paths`
+    dictionary (path_id, path) on close.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._writer = BatchedWriter("commit_paths", COMMIT_PATHS_SCHEMA)
+
+    def add(self, commit: str, paths: list[str]):
+        ids = []
+        for path in paths:
+            path_id = self._ids.get(path)
+            if path_id is None:
+                path_id = self._ids[path] = len(self._ids)
+            ids.append(path_id)
+        self._writer.writerow([commit, ids])
+
+    def close(self):
+        self._writer.close()
+        with BatchedWriter("paths", PATHS_SCHEMA) as paths_writer:
+            # ordered by path, so prefixes are contiguous
+            paths_writer.writerows(
+                sorted(([i, p] for p, i in self._ids.items()), key=lambda r: r[1])
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,351 @@
+import ast
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import orjson
+
+DEBUG = os.getenv("DEBUG", "false")
+level = logging.INFO
+if DEBUG != "false":
+    level = logging.DEBUG
+
+logging.basicConfig(
+    level=level,
+    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+kernel_path = os.getenv("KERNEL_PATH", ".")
+extra_kernel_paths = [
+    path for path in os.getenv("EXTRA_KERNEL_PATHS", "").split(os.pathsep) if path
+]
+
+# comma separated stages to run, the others are left as they are
+PIPELINE_STAGES = os.getenv("PIPELINE_STAGES", "all")
+# comma separated stages to run even if their fingerprint did not change, or "all"
+PIPELINE_FORCE = os.getenv("PIPELINE_FORCE", "")
+
+# same as columnar_io, which is not imported: polars and pyarrow would add their memory
+# to this process, and so to the peak rss of every stage forked from it
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")
+# same as enrich_from_git.py, the datasets it writes besides enhanced
+LOAD_TAGS_FROM_REPO = os.getenv("LOAD_TAGS_FROM_REPO", "false") != "false"
+CAPTURE_PATHS = os.getenv("CAPTURE_PATHS", "true") != "false"
+
+STATE_PATH = "./data/pipeline_state.json"
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(os.path.dirname(SCRIPTS_DIR), "server")
+
+
+@dataclass
+class Stage:
+    name: str
+    script: str
+    # stages that must finish before this one starts
+    after: list[str] = field(default_factory=list)
+    # datasets read and written, as names for columnar_io.data_path or paths
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+    # settings changing the outputs, workers and batch sizes are left out on purpose
+    settings: list[str] = field(default_factory=list)
+    # the stage reads the kernel repositories at these revisions
+    kernel_revs: list[str] = field(default_factory=list)
+    kernel_paths: list[str] = field(default_factory=lambda: [kernel_path])
+    # arguments of the script printing the state of inputs outside ./data
+    probe_args: list[str] = field(default_factory=list)
+    # folder of the script and its local modules, also its working directory when
+    # set to anything else than SCRIPTS_DIR
+    directory: str = SCRIPTS_DIR
+
+
+# grpc -> enrich -> stitch -> export, maintainers only joins at the stitch
+STAGES = [
+    Stage(
+        "grpc",
+        "grpc_script.py",
+        outputs=["commits", "trees", "commit_trees"],
+        settings=[
+            "GRAPH_GRPC_SERVER",
+            "KERNEL_TREE",
+            "KERNEL_TREES",
+            "INITIAL_NODE",
+            "DEFAULT_BRANCH",
+            "OUTPUT_FORMAT",
+        ],
+        # the graph export has no file to hash, its latest snapshots are asked instead
+        probe_args=["--latest-snapshots"],
+    ),
+    Stage(
+        "enrich",
+        "enrich_from_git.py",
+        after=["grpc"],
+        inputs=["commits"],
+        outputs=[
+            "enhanced",
+            *(["tags"] if LOAD_TAGS_FROM_REPO else []),
+            *(["paths", "commit_paths"] if CAPTURE_PATHS else []),
+        ],
+        settings=[
+            "KERNEL_PATH",
+            "EXTRA_KERNEL_PATHS",
+            "LOAD_TAGS_FROM_REPO",
+            "CAPTURE_PATHS",
+            "OUTPUT_FORMAT",
+        ],
+        kernel_revs=["HEAD"],
+        kernel_paths=[kernel_path, *extra_kernel_paths],
+    ),
+    Stage(
+        "maintainers",
+        "get_official_kernel_maintainers.py",
+        outputs=["maintainers_history", "maintainers_snapshots"],
+        settings=[
+            "KERNEL_PATH",
+            "MAINTAINERS_BRANCH",
+            "SNAPSHOT_EVERY",
+            "OUTPUT_FORMAT",
+        ],
+        kernel_revs=[os.getenv("MAINTAINERS_BRANCH", "master")],
+    ),
+    Stage(
+        "stitch",
+        "stitch_data_into_final_payload.py",
+        after=["enrich", "maintainers"],
+        inputs=[
+            "enhanced",
+            "maintainers_history",
+            "maintainers_snapshots",
+            "trees",
+            "commit_trees",
+        ],
+        # written last, the outputs are either files or year partitions
+        outputs=["./data/manifest.json"],
+        settings=["OUTPUT_FORMAT", "STITCH_PARTITIONED", "CONTRIBUTOR_MIN_GAP_DAYS"],
+    ),
+    # the static payloads served by nginx, stale until exported again
+    Stage(
+        "export",
+        "export_static.py",
+        after=["stitch"],
+        inputs=["./data/manifest.json", "tags"],
+        # EXPORT_DIR is relative to the server folder the stage runs from
+        outputs=[
+            os.path.normpath(
+                os.path.join(
+                    SERVER_DIR, os.getenv("EXPORT_DIR", "./static/data"), "latest.json"
+                )
+            )
+        ],
+        settings=["EXPORT_DIR", "EXPORT_WINDOWS"],
+        # run from server/, it reads ../data
+        directory=SERVER_DIR,
+    ),
+]
+
+
+def dataset_path(name: str) -> str:
+    return name if "/" in name else f"./data/{name}.{OUTPUT_FORMAT}"
+
+
+def local_modules(script: str, directory: str = SCRIPTS_DIR) -> list[str]:
+    """the script and the modules of its folder it imports, recursively"""
+    found = []
+    pending = [script]
+    while pending:
+        module = pending.pop()
+        if module in found:
+            continue
+        found.append(module)
+        with open(os.path.join(directory, module), "rb") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                if os.path.exists(os.path.join(directory, f"{name}.py")):
+                    pending.append(f"{name}.py")
+    return sorted(found)
+
+
+def hash_file(digest, path: str):
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+
+
+def fingerprint(stage: Stage) -> str | None:
+    """
+    hash of the stage code, settings, kernel revisions, input contents and probe output.
+    None when the probe failed, the stage is then always run
+    """
+    digest = hashlib.sha256()
+    for module in local_modules(stage.script, stage.directory):
+        digest.update(module.encode())
+        hash_file(digest, os.path.join(stage.directory, module))
+    for setting in stage.settings:
+        digest.update(f"{setting}={os.getenv(setting)}".encode())
+    for path in stage.kernel_paths if stage.kernel_revs else []:
+        revs = subprocess.run(
+            ["git", "-C", path, "rev-parse", *stage.kernel_revs],
+            capture_output=True,
+            check=True,
+        ).stdout
+        digest.update(revs)
+    for name in stage.inputs:
+        digest.update(name.encode())
+        # the tree membership is missing from datasets crawled before it existed
+        if os.path.exists(dataset_path(name)):
+            hash_file(digest, dataset_path(name))
+    if stage.probe_args:
+        probe = subprocess.run(
+            [
+                sys.executable,
+                os.path.join(stage.directory, stage.script),
+                *stage.probe_args,
+            ],
+            capture_output=True,
+        )
+        if probe.returncode != 0:
+            logging.warning(f"{stage.name}: probe failed, running the stage")
+            return None
+        digest.update(probe.stdout)
+    return digest.hexdigest()
+
+
+def read_state() -> dict:
+    if not os.path.exists(STATE_PATH):
+        return {"stages": {}}
+    with open(STATE_PATH, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def write_state(state: dict):
+    with open(f"{STATE_PATH}.tmp", "wb") as f:
+        f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
+    os.replace(f"{STATE_PATH}.tmp", STATE_PATH)
+
+
+def usage_path(stage: Stage) -> str:
+    return os.path.abspath(f"./data/pipeline_{stage.name}.usage.json")
+
+
+def read_usage(stage: Stage) -> dict:
+    """peak memory written by stage_launcher.py, empty if the stage died before"""
+    try:
+        with open(usage_path(stage), "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    finally:
+        if os.path.exists(usage_path(stage)):
+            os.remove(usage_path(stage))
+
+
+def is_up_to_date(stage: Stage, state: dict, stage_fingerprint: str | None) -> bool:
+    previous = state["stages"].get(stage.name, {})
+    return (
+        stage_fingerprint is not None
+        and previous.get("fingerprint") == stage_fingerprint
+        and previous.get("returncode") == 0
+        and all(os.path.exists(dataset_path(name)) for name in stage.outputs)
+    )
+
+
+def run():
+    selected = {s.name for s in STAGES}
+    if PIPELINE_STAGES != "all":
+        selected = set(PIPELINE_STAGES.split(","))
+    forced = {s.name for s in STAGES} if PIPELINE_FORCE == "all" else set()
+    forced |= {name for name in PIPELINE_FORCE.split(",") if name and name != "all"}
+
+    os.makedirs("./data", exist_ok=True)
+    state = read_state()
+    # stages not selected count as finished, their outputs are used as they are
+    done = {s.name for s in STAGES if s.name not in selected}
+    failed = set()
+    running = {}
+    pending = [s for s in STAGES if s.name in selected]
+    start = time.perf_counter()
+
+    while pending or running:
+        # start every stage whose dependencies finished, independent branches run at once
+        for stage in list(pending):
+            if any(name in failed for name in stage.after):
+                logging.error(f"{stage.name}: skipped, a previous stage failed")
+                pending.remove(stage)
+                failed.add(stage.name)
+                continue
+            if not all(name in done for name in stage.after):
+                continue
+            pending.remove(stage)
+
+            # fingerprinted once its inputs are final
+            stage_fingerprint = fingerprint(stage)
+            if stage.name not in forced and is_up_to_date(
+                stage, state, stage_fingerprint
+            ):
+                logging.info(f"{stage.name}: unchanged, skipping")
+                done.add(stage.name)
+                continue
+
+            logging.info(f"{stage.name}: running {stage.script}")
+            # run by the launcher, which reports the peak memory of the stage alone
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(SCRIPTS_DIR, "stage_launcher.py"),
+                    usage_path(stage),
+                    os.path.join(stage.directory, stage.script),
+                ],
+                cwd=None if stage.directory == SCRIPTS_DIR else stage.directory,
+            )
+            running[process.pid] = (stage, stage_fingerprint, time.perf_counter())
+
+        if not running:
+            continue
+
+        # reap whichever stage finishes first, with its own resource usage
+        pid, status, usage = os.wait4(-1, 0)
+        if pid not in running:
+            continue
+        stage, stage_fingerprint, started = running.pop(pid)
+        returncode = os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - started
+        # wait4 only has the peak of the whole process tree, from the rss at fork
+        max_rss_kb = read_usage(stage).get("max_rss_kb", usage.ru_maxrss)
+        state["stages"][stage.name] = {
+            "fingerprint": stage_fingerprint if returncode == 0 else None,
+            "returncode": returncode,
+            "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "wall_seconds": round(wall, 3),
+            "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+            "max_rss_kb": max_rss_kb,
+        }
+        write_state(state)
+
+        if returncode == 0:
+            logging.info(
+                f"{stage.name}: done in {wall:.1f}s, peak rss {max_rss_kb / 1024:.0f} MiB"
+            )
+            done.add(stage.name)
+        else:
+            logging.error(f"{stage.name}: failed with exit code {returncode}")
+            failed.add(stage.name)
+
+    logging.info(f"pipeline finished in {time.perf_counter() - start:.1f}s")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,48 @@
+import atexit
+import os
+import resource
+import runpy
+import sys
+
+import orjson
+
+# Runs a step script in this process, and writes its resource usage to a json file at
+# exit. Used by pipeline.py and benchmark.py to measure the peak memory of a step: the
+# peak rss reported by wait4 starts at the rss of the parent at fork, VmHWM only counts
+# the memory of the process after exec.
+# usage: python stage_launcher.py <usage json path> <script> [script args]
+
+
+def peak_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def write_usage(path: str):
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with open(path, "wb") as f:
+        f.write(
+            orjson.dumps(
+                {
+                    "max_rss_kb": peak_rss_kb(),
+                    # pool workers, they start from the rss of the step at fork
+                    "children_max_rss_kb": children.ru_maxrss,
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    usage_path, script, *args = sys.argv[1:]
+    # registered first, so it runs after the exit handlers of the script
+    atexit.register(write_usage, usage_path)
+    sys.argv = [script, *args]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name="__main__")
@@ -1,9 +1,25 @@
 import logging
-import orjson
 import os
+import shutil
+from datetime import datetime
+from glob import glob
+
 import polars as pl
-import duckdb
 
+from columnar_io import (
+    data_path,
+    read_frame,
+    PARQUET_ROW_GROUP_SIZE,
+    scan_frame,
+    sink_tuned_parquet,
+    write_tuned_parquet,
+    COMMIT_TREES_SCHEMA,
+    ENHANCED_SCHEMA,
+    TREES_SCHEMA,
+)
+from dataset_manifest import bump_manifest, describe_parquet, replace_atomically
+import instrumentation
+from maintainers_history import MaintainersHistory
 
 DEBUG = os.getenv("DEBUG", "false")
 level = logging.INFO
@@ -16,79 +32,104 @@ logging.basicConfig(
     datefmt="%H:%M:%S",
 )
 
-
-# reads a list of dicts, and returns a list of unique emails
-def unique_emails_in_attributions(attributions: list[str]) -> int | None:
-    attributions = orjson.loads(attributions)
-    if not attributions or len(attributions) == 0:
-        return None
-    return list(set([attr["email"] for attr in attributions]))
-
-
-# take a list of stringified json list[dicts], parses, and joins them into a single list
-def merge_aggregated_attributions(attributions_list: list[str]) -> str | None:
-    merged = []
-    if not attributions_list.is_empty():
-        for attributions in attributions_list:
-            attributions = orjson.loads(attributions)
-            if isinstance(attributions, list):
-                merged = merged + attributions
-            else:
-                merged.append(attributions)
-
-        # TODO: deduplication
-        # return set([orjson.dumps(element, sort_keys=True) for element in merged])
-    return orjson.dumps(merged).decode()
-
-
-def run():
-    commits = pl.read_csv("./data/enhanced.csv", separator="|", try_parse_dates=True)
-    print(commits.head())
-
-    maintainers = pl.read_csv("./data/maintainers.csv", separator="|")
-
-    maintainers = maintainers.with_columns(
-        [
-            # parse to list
-            pl.col("maintainers")
-            .map_elements(
-                # load maintainers and de-duplicate them
-                lambda m: list(set(orjson.loads(m))),
-                return_dtype=pl.List(pl.String),
+# process commits with the polars streaming engine instead of collecting them in memory
+STITCH_STREAMING = os.getenv("STITCH_STREAMING", "false") != "false"
+
+# only process the commits after the last run, appending to the existing outputs
+STITCH_INCREMENTAL = os.getenv("STITCH_INCREMENTAL", "false") != "false"
+
+# bumped when the columns of the outputs change
+SCHEMA_VERSION = 1
+
+# write by_commit and by_date as ./data/<name>/year=<year>/ directories instead of single files
+STITCH_PARTITIONED = os.getenv("STITCH_PARTITIONED", "false") != "false"
+
+# absences shorter than this are not recorded in contributor_gaps, the api can only ask
+# for returns and departures after at least that many days
+CONTRIBUTOR_MIN_GAP_DAYS = int(os.getenv("CONTRIBUTOR_MIN_GAP_DAYS", "30"))
+
+# by_date rolled up into longer periods, written to ./data/by_<name>.parquet
+ROLLUPS = {"week": "1w", "month": "1mo", "quarter": "1q", "year": "1y"}
+ROLLUP_SUM_COLUMNS = [
+    "number_of_commits",
+    "insertions",
+    "deletions",
+    "total_line_change",
+    "net_line_change",
+]
+ROLLUP_SET_COLUMNS = [
+    "author",
+    "committer",
+    "extra_contributors",
+    "all_contributors",
+    "author_in_maintainers_file",
+    "committer_in_maintainers_file",
+    "extra_attributions_in_maintainers_file",
+    "attributions_ack",
+    "attributions_reviewed",
+    "attributions_reported",
+    "attributions_suggested",
+    "attributions_tested",
+]
+
+
+def declared_in_version(
+    df: pl.LazyFrame, intervals: pl.LazyFrame, column: str
+) -> pl.LazyFrame:
+    """
+    (commit_index, email) of the emails in `column` declared in the maintainers version
+    of their commit. List columns are exploded, keeping their order.
+    """
+    emails = df.select("commit_index", "maintainers_version", column)
+    if isinstance(emails.collect_schema()[column], pl.List):
+        emails = emails.explode(column)
+    return (
+        # null emails never match, and the streaming engine mishandles null join keys
+        emails.drop_nulls(column)
+        .join(intervals, left_on=column, right_on="email", maintain_order="left")
+        .filter(
+            pl.col("maintainers_version").is_between(
+                pl.col("first_version"), pl.col("end_version"), closed="left"
             )
-            .alias("maintainers"),
-        ]
+        )
+        .select("commit_index", column)
     )
 
-    print(maintainers.head())
 
-    logging.info("Runningn query in duckdb")
-    df = (
-        duckdb.sql("""
-        SELECT c.*, m.maintainers as maintainers , len(m.maintainers) as declared_maintainers FROM commits c
-        left join maintainers m on
-        c.commit == m.commit 
-        order by committer_date
-    """)
-        .pl()
-        .lazy()
-    )
-
-    # all commits before a change have the same declared contributors
-    df = df.with_columns(
-        pl.col("maintainers").fill_null(strategy="backward"),
-        pl.col("declared_maintainers").fill_null(strategy="backward"),
+def by_commit_frame(commits: pl.LazyFrame, history: MaintainersHistory) -> pl.LazyFrame:
+    """per commit columns, ordered by committer_date"""
+    # maintainers are kept as versions of a set instead of a list copied onto every commit:
+    # the number of emails declared by each version, and the stretches of versions each
+    # email is declared in
+    versions = history.declared_counts().sort("committer_date", maintain_order=True)
+    intervals = history.membership_intervals().lazy()
+
+    # all commits before a change have the same declared contributors, so each commit gets
+    # the first version committed at or after it, and the tail end gets the last one.
+    # an as-of lookup into the version dates, it runs as a plain expression on every chunk
+    position = (
+        pl.lit(versions["committer_date"])
+        .search_sorted(pl.col("committer_date"), side="left")
+        .clip(upper_bound=versions.height - 1)
     )
-    # does the same, but fixing the tail end of the df
-    df = df.with_columns(
-        pl.col("maintainers").fill_null(strategy="forward"),
-        pl.col("declared_maintainers").fill_null(strategy="forward"),
+    df = (
+        commits.with_columns(pl.col("committer_date").cast(pl.Datetime("us")))
+        # stable, commit_index must be the same in every branch joined back below
+        .sort("committer_date", maintain_order=True)
+        .with_columns(
+            pl.lit(versions["version"]).gather(position).alias("maintainers_version"),
+            pl.lit(versions["declared_maintainers"])
+            .gather(position)
+            .alias("declared_maintainers"),
+        )
+        .with_row_index("commit_index")
     )
 
     # add column with unique contributors in commit
     df = df.with_columns(
         pl.col("attributions")
-        .map_elements(unique_emails_in_attributions, return_dtype=pl.List(pl.String))
+        .list.eval(pl.element().struct.field("email"))
+        .list.unique()
         .alias("extra_contributors")
     )
 
@@ -114,129 +155,83 @@ def run():
     #     pl.col("all_contributors").list.len().alias("num_total_contributors"),
     # )
 
-    def intersect(row: pl.Struct):
-        mset = set(row["maintainers"])
-        author = None
-        committer = None
-        extra = []
-        # intersection between authors and maintainers file
-        if row["author"] in mset:
-            author = row["author"]
-        # intersection between committer and maintainers file
-        if row["committer"] in mset:
-            committer = row["committer"]
-        # intersection between extra_contributors and maintainers file
-        for attr in row["extra_contributors"]:
-            if attr is not None:
-                if attr in mset:
-                    extra.append(attr)
-        return {
-            "author_in_maintainers_file": author,
-            "committer_in_maintainers_file": committer,
-            "extra_attributions_in_maintainers_file": extra,
-        }
-
-    # run intersections between maintainers and other columns
-    df = df.with_columns(
-        # intersection between authors and maintainers file
-        pl.struct(["author", "committer", "extra_contributors", "maintainers"])
-        .map_elements(
-            intersect,
-            return_dtype=pl.Struct(
-                [
-                    pl.Field("author_in_maintainers_file", pl.String),
-                    pl.Field("committer_in_maintainers_file", pl.String),
-                    pl.Field(
-                        "extra_attributions_in_maintainers_file",
-                        pl.List(pl.String),
-                    ),
-                ]
-            ),
+    # run intersections between maintainers and other columns, as joins against the
+    # membership intervals of the commit's maintainers version
+    df = (
+        df.join(
+            declared_in_version(df, intervals, "author"),
+            on="commit_index",
+            how="left",
+            maintain_order="left",
         )
-        .alias("intersect")
-    ).unnest("intersect")
-
-    def parse_known_tags_from_attributions(row: pl.List(pl.Struct)) -> pl.Struct:
-        ack = set()
-        reviewed = set()  # Reveiwed, reviwed
-        reported = set()
-        suggested = set()  # Suggested-by, and also typos like Sugessted-by
-        tested = set()
-        # Co-authored
-        # Co-developed
-        #
-        # there are mixed cases, like: "Reported-and-reviwed-by"
-
-        for item in row:
-            contrib_type = item["type"].lower()
-            email = item["email"]
-            if email is not None:
-                if "ack" in contrib_type:
-                    ack.add(email)
-                elif "revi" in contrib_type:
-                    reviewed.add(email)
-                elif "repor" in contrib_type:
-                    reported.add(email)
-                elif "test" in contrib_type:
-                    tested.add(email)
-                elif "sug" in contrib_type:
-                    suggested.add(email)
-
-        ack = list(ack)
-        reviewed = list(reviewed)
-        reported = list(reported)
-        suggested = list(suggested)
-        tested = list(tested)
-
-        return {
-            "attributions_ack": ack if len(ack) > 0 else None,
-            "attributions_reviewed": reviewed if len(reviewed) > 0 else None,
-            "attributions_reported": reported if len(reported) > 0 else None,
-            "attributions_suggested": suggested if len(suggested) > 0 else None,
-            "attributions_tested": tested if len(tested) > 0 else None,
-        }
-
-    df = df.with_columns(
-        pl.col("attributions")
-        .str.json_decode(
-            dtype=pl.List(
-                pl.Struct(
-                    [
-                        pl.Field("type", pl.String),
-                        pl.Field("name", pl.String),
-                        pl.Field("email", pl.String),
-                    ]
-                )
-            )
+        .join(
+            declared_in_version(df, intervals, "committer"),
+            on="commit_index",
+            how="left",
+            maintain_order="left",
+        )
+        .join(
+            declared_in_version(df, intervals, "extra_contributors")
+            .group_by("commit_index", maintain_order=True)
+            .agg("extra_contributors"),
+            on="commit_index",
+            how="left",
+            maintain_order="left",
         )
-        .map_elements(
-            lambda s: parse_known_tags_from_attributions(s),
-            return_dtype=pl.Struct(
-                [
-                    pl.Field("attributions_ack", pl.List(pl.String)),
-                    pl.Field("attributions_reviewed", pl.List(pl.String)),
-                    pl.Field("attributions_reported", pl.List(pl.String)),
-                    pl.Field("attributions_suggested", pl.List(pl.String)),
-                    pl.Field("attributions_tested", pl.List(pl.String)),
-                ]
-            ),
+        .with_columns(
+            pl.col("author_right").alias("author_in_maintainers_file"),
+            pl.col("committer_right").alias("committer_in_maintainers_file"),
+            pl.col("extra_contributors_right")
+            .fill_null(pl.lit([], dtype=pl.List(pl.String)))
+            .alias("extra_attributions_in_maintainers_file"),
         )
-        .alias("attributions_list")
-    ).unnest("attributions_list")
+        .drop("author_right", "committer_right", "extra_contributors_right")
+    )
 
-    logging.info("collecting polars operations")
-    df = df.collect()
+    # classify each attribution by its type, the first match wins.
+    # there are typos (Reveiwed, reviwed, Sugessted-by...) and mixed cases, like: "Reported-and-reviwed-by"
+    # Co-authored
+    # Co-developed
+    contrib_type = pl.element().struct.field("type").str.to_lowercase()
+    known_tag = (
+        pl.when(contrib_type.str.contains("ack", literal=True))
+        .then(pl.lit("ack"))
+        .when(contrib_type.str.contains("revi", literal=True))
+        .then(pl.lit("reviewed"))
+        .when(contrib_type.str.contains("repor", literal=True))
+        .then(pl.lit("reported"))
+        .when(contrib_type.str.contains("test", literal=True))
+        .then(pl.lit("tested"))
+        .when(contrib_type.str.contains("sug", literal=True))
+        .then(pl.lit("suggested"))
+    )
 
-    df = df.sort("committer_date", descending=False)
+    # unique emails of a known tag, or null if there are none
+    def emails_with_known_tag(tag: str) -> pl.Expr:
+        emails = pl.col("attributions").list.eval(
+            pl.element()
+            .struct.field("email")
+            .filter(
+                (known_tag == tag) & pl.element().struct.field("email").is_not_null()
+            )
+            .unique(maintain_order=True)
+        )
+        return pl.when(emails.list.len() > 0).then(emails)
+
+    df = df.with_columns(
+        [
+            emails_with_known_tag(tag).alias(f"attributions_{tag}")
+            for tag in ["ack", "reviewed", "reported", "suggested", "tested"]
+        ]
+    )
 
-    logging.info("writing by_commit.parquet file ")
+    return df.drop("commit_index", "maintainers_version")
 
-    df = df.drop("maintainers")
-    df.write_parquet("./data/by_commit.parquet")
 
+def by_date_frame(by_commit: pl.LazyFrame) -> pl.LazyFrame:
+    """per day aggregation of the by_commit rows, only days with commits"""
     # transform to rows by date
-    df = df.lazy()
-    df = df.group_by(
+    df = by_commit.group_by(
         pl.col("committer_date").dt.truncate("1d").alias("committer_date")
     ).agg(
         # number_of_commits
@@ -245,8 +240,8 @@ def run():
         pl.col("insertions").sum(),
         # deletions
         pl.col("deletions").sum(),
-        # attributions
-        pl.col("attributions").filter(pl.col("attributions") != "[]"),
+        # attributions, merged into a single list per day
+        pl.col("attributions").filter(pl.col("attributions").list.len() > 0).flatten(),
         # author
         pl.col("author").unique(),
         # committer
@@ -255,7 +250,6 @@ def run():
         pl.col("tag").unique(),
         # extra_contributors
         pl.col("extra_contributors")
-        # extra_contributors
         .filter(pl.col("extra_contributors") != [])
         .flatten()
         .unique(),
@@ -283,11 +277,6 @@ def run():
 
     df = df.with_columns(
         [
-            # attributions were aggregated by combining list of strings. Parse their jsons here, and merge into a single json
-            pl.col("attributions")
-            .map_elements(merge_aggregated_attributions, return_dtype=pl.String)
-            .alias("attributions"),
-            #
             # coalease tags into a space separated string, or null
             pl.col("tag")
             .map_elements(
@@ -307,11 +296,11 @@ def run():
         net_line_change=pl.col("insertions").sub(pl.col("deletions")),
     )
 
-    logging.info("collecting grouped df")
-    df = df.collect()
-    logging.info("collected")
+    return df
+
 
-    # collect here, upsample operations are not available in the lazy frame
+def fill_days(df: pl.DataFrame) -> pl.DataFrame:
+    # upsample operations are not available in the lazy frame
     # fill non existing dates with null values
     df = df.upsample(time_column="committer_date", every="1d")
 
@@ -348,11 +337,418 @@ def run():
         ]
     )
 
-    logging.info("writing by_date.parquet file ")
-    logging.info(df)
-    logging.info(df.columns)
-    df.write_parquet("./data/by_date.parquet")
+    return df
+
+
+def rollup_frame(by_date: pl.LazyFrame, every: str) -> pl.LazyFrame:
+    """
+    by_date rows grouped into periods of `every` (weeks start on monday): sums of the
+    additive columns, and the exact distinct set of emails of each list column with
+    its size in a <column>_count column
+    """
+    return (
+        by_date.group_by(pl.col("committer_date").dt.truncate(every))
+        .agg(
+            pl.col(ROLLUP_SUM_COLUMNS).sum(),
+            pl.col("declared_maintainers").max(),
+            *[
+                pl.col(column).flatten().drop_nulls().unique().sort()
+                for column in ROLLUP_SET_COLUMNS
+            ],
+        )
+        .with_columns(
+            pl.col(column).list.len().alias(f"{column}_count")
+            for column in ROLLUP_SET_COLUMNS
+        )
+        .sort("committer_date")
+    )
+
+
+def scan_output(name: str) -> pl.LazyFrame:
+    if STITCH_PARTITIONED:
+        return pl.scan_parquet(
+            f"./data/{name}/year=*/*.parquet", hive_partitioning=True
+        ).drop("year")
+    return pl.scan_parquet(f"./data/{name}.parquet")
+
+
+def output_files(name: str) -> list[str]:
+    if STITCH_PARTITIONED:
+        return sorted(glob(f"./data/{name}/year=*/*.parquet"))
+    return [f"./data/{name}.parquet"]
+
+
+def output_exists(name: str) -> bool:
+    files = output_files(name)
+    return bool(files) and all(os.path.exists(path) for path in files)
+
+
+def write_output(name: str, lf: pl.LazyFrame, since: datetime | None = None):
+    """
+    Writes the date sorted rows of an output to ./data/<name>.parquet, or with
+    STITCH_PARTITIONED to one ./data/<name>/year=<year>/ directory per year.
+    With `since`, only the partitions from its year on are rewritten, and lf only
+    needs to hold their rows.
+    """
+    if not STITCH_PARTITIONED:
+        replace_atomically(
+            f"./data/{name}.parquet",
+            lambda tmp_path: sink_tuned_parquet(lf, tmp_path),
+        )
+        # partitions of a previous run, the server would read them first
+        shutil.rmtree(f"./data/{name}", ignore_errors=True)
+        return
+
+    # staged once, instead of running the whole plan again for every year
+    staging_path = f"./data/{name}.staging.parquet"
+    try:
+        sink_tuned_parquet(lf, staging_path)
+        staged = pl.scan_parquet(staging_path)
+        years = (
+            staged.select(pl.col("committer_date").dt.year().unique())
+            .collect()
+            .to_series()
+            .to_list()
+        )
+        for year in sorted(years):
+            logging.info(f"writing {name}/year={year} partition")
+            partition = f"./data/{name}/year={year}"
+            os.makedirs(partition, exist_ok=True)
+            rows = staged.filter(pl.col("committer_date").dt.year() == year)
+            replace_atomically(
+                f"{partition}/data.parquet",
+                lambda tmp_path: sink_tuned_parquet(rows, tmp_path),
+            )
+        # years left without rows
+        for partition in glob(f"./data/{name}/year=*"):
+            year = int(partition.rsplit("=", 1)[1])
+            if year not in years and (since is None or year >= since.year):
+                shutil.rmtree(partition)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+    # file of a previous run without partitions
+    if os.path.exists(f"./data/{name}.parquet"):
+        os.remove(f"./data/{name}.parquet")
+
+
+def write_rollups():
+    # rebuilt from by_date on every run, it is small compared to the commits
+    by_date = scan_output("by_date")
+    for name, every in ROLLUPS.items():
+        logging.info(f"writing by_{name}.parquet file ")
+        df = instrumentation.collect(rollup_frame(by_date, every), f"by_{name}")
+        replace_atomically(
+            f"./data/by_{name}.parquet",
+            lambda tmp_path: write_tuned_parquet(df, tmp_path),
+        )
+
+
+def contributor_activity(by_date: pl.LazyFrame) -> pl.LazyFrame:
+    """(role, email, day) of every day each email appears in a contributor column"""
+    return (
+        by_date.select(
+            pl.col("committer_date").dt.date().alias("day"), *ROLLUP_SET_COLUMNS
+        )
+        .unpivot(index="day", variable_name="role", value_name="email")
+        .explode("email")
+        .drop_nulls("email")
+        .unique()
+    )
+
+
+def write_contributor_index():
+    """
+    Writes the first and last day every email was seen in each contributor column
+    (its role), to ./data/contributors.parquet, and its absences of at least
+    CONTRIBUTOR_MIN_GAP_DAYS days to ./data/contributor_gaps.parquet, so new, returning
+    and churned contributors are counted without comparing the email lists of every day.
+    """
+    activity = instrumentation.collect(
+        contributor_activity(scan_output("by_date")), "contributor_activity"
+    )
+
+    contributors = activity.group_by("role", "email").agg(
+        first_seen=pl.col("day").min(),
+        last_seen=pl.col("day").max(),
+        active_days=pl.len(),
+    )
+    logging.info(f"writing contributors.parquet file, {contributors.height} rows")
+    replace_atomically(
+        "./data/contributors.parquet",
+        lambda tmp_path: write_tuned_parquet(
+            contributors, tmp_path, sort_by=["role", "first_seen", "email"]
+        ),
+    )
+
+    # the day before each return, with the length of the absence
+    gaps = (
+        activity.sort("role", "email", "day")
+        .with_columns(left_on=pl.col("day").shift(1).over("role", "email"))
+        .rename({"day": "returned_on"})
+        .with_columns(
+            gap_days=(pl.col("returned_on") - pl.col("left_on"))
+            .dt.total_days()
+            .cast(pl.Int32)
+        )
+        .filter(pl.col("gap_days") >= CONTRIBUTOR_MIN_GAP_DAYS)
+        .select("role", "email", "left_on", "returned_on", "gap_days")
+    )
+    logging.info(f"writing contributor_gaps.parquet file, {gaps.height} rows")
+    replace_atomically(
+        "./data/contributor_gaps.parquet",
+        lambda tmp_path: write_tuned_parquet(
+            gaps, tmp_path, sort_by=["role", "returned_on", "email"]
+        ),
+    )
+
+
+def write_by_tree() -> bool:
+    """
+    Writes ./data/by_tree_date.parquet, the by_date rows of every tree crawled with
+    KERNEL_TREES, with the tree name in a `tree` column.
+    Rebuilt from by_commit and the tree membership of the commits on every run, as a
+    newly crawled tree can contain commits processed before.
+    Returns False when a single tree was crawled, its rows are the by_date ones, or when
+    none of the trees has processed commits.
+    """
+    path = "./data/by_tree_date.parquet"
+    trees = None
+    if os.path.exists(data_path("trees")):
+        trees = read_frame("trees", TREES_SCHEMA)
+    if trees is None or trees.height < 2:
+        # left by a previous run crawling more trees
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+
+    by_commit = scan_output("by_commit").join(
+        scan_frame("commit_trees", COMMIT_TREES_SCHEMA), on="commit", how="left"
+    )
+    frames = []
+    for tree_id, name in trees.select("tree_id", "name").iter_rows():
+        logging.info(f"aggregating the days of {name}")
+        days = instrumentation.collect(
+            by_date_frame(by_commit.filter((pl.col("trees") & (1 << tree_id)) != 0)),
+            "by_tree_date",
+        )
+        if days.height:
+            frames.append(fill_days(days).with_columns(tree=pl.lit(name)))
+    if not frames:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    df = pl.concat(frames).sort("tree", "committer_date", maintain_order=True)
+
+    logging.info("writing by_tree_date.parquet file ")
+    # grouped by tree, so a tree filter skips the row groups of the others
+    replace_atomically(
+        path,
+        lambda tmp_path: write_tuned_parquet(
+            df, tmp_path, sort_by=["tree", "committer_date"]
+        ),
+    )
+    return True
+
+
+def incremental_cutoff(history: MaintainersHistory) -> datetime | None:
+    """
+    Start of the first day to recompute, None when there is nothing to append to.
+    Commits missing from by_commit can be older than the processed ones (committed
+    long before being merged, or from a newly crawled tree), so their earliest day is
+    processed again, and so are the commits after the last maintainers version, which
+    were given that version by default.
+    """
+    if not (output_exists("by_commit") and output_exists("by_date")):
+        return None
+    last_date = (
+        scan_output("by_commit").select(pl.col("committer_date").max()).collect().item()
+    )
+    if last_date is None:
+        return None
+
+    new_commits = (
+        scan_frame("enhanced", ENHANCED_SCHEMA)
+        .join(scan_output("by_commit").select("commit"), on="commit", how="anti")
+        .select(
+            count=pl.len(),
+            earliest=pl.col("committer_date").min(),
+            late=(pl.col("committer_date") < last_date).sum(),
+        )
+        .collect()
+        .row(0, named=True)
+    )
+    logging.info(
+        f"{new_commits['count']} new commits, {new_commits['late']} of them "
+        f"committed before the last processed one ({last_date})"
+    )
+
+    cutoff = new_commits["earliest"] or last_date
+    version_date = history.versions.filter(pl.col("committer_date") <= last_date)[
+        "committer_date"
+    ].max()
+    if version_date is not None:
+        cutoff = min(cutoff, version_date)
+    return datetime.combine(cutoff.date(), datetime.min.time())
+
+
+def run_incremental(history: MaintainersHistory, cutoff: datetime):
+    logging.info(f"recomputing commits from {cutoff}")
+    # the dates of datasets written with second timestamps are cast before filtering,
+    # their row group statistics cannot be compared with the cutoff
+    commits = (
+        scan_frame("enhanced", ENHANCED_SCHEMA)
+        .with_columns(pl.col("committer_date").cast(pl.Datetime("us")))
+        .filter(pl.col("committer_date") >= cutoff)
+    )
+    new_commits = instrumentation.collect(
+        by_commit_frame(commits, history), "by_commit"
+    )
+    logging.info(f"{new_commits.height} commits to append")
+
+    new_days = fill_days(
+        instrumentation.collect(by_date_frame(new_commits.lazy()), "by_date")
+    )
+
+    # the kept rows are streamed from the previous files into the new ones
+    def append(name, new_rows):
+        kept = scan_output(name).filter(pl.col("committer_date") < cutoff)
+        if STITCH_PARTITIONED:
+            # only the partitions from the cutoff year on are rewritten
+            kept = kept.filter(pl.col("committer_date") >= datetime(cutoff.year, 1, 1))
+        write_output(name, pl.concat([kept, new_rows.lazy()]), since=cutoff)
+
+    logging.info("appending to by_commit ")
+    with instrumentation.phase("write_by_commit"):
+        append("by_commit", new_commits)
+    logging.info("appending to by_date ")
+    with instrumentation.phase("write_by_date"):
+        append("by_date", new_days)
+
+
+def write_by_commit_chunks(history: MaintainersHistory):
+    """
+    Writes by_commit from chunks of one year of commits, the memory of the stitch is
+    bounded by the commits of the largest year instead of the whole history.
+    """
+    commits = scan_frame("enhanced", ENHANCED_SCHEMA).with_columns(
+        pl.col("committer_date").cast(pl.Datetime("us"))
+    )
+    years = (
+        commits.select(pl.col("committer_date").dt.year().unique().sort())
+        .collect()
+        .to_series()
+        .to_list()
+    )
+    chunks = []
+    try:
+        for year in years:
+            logging.info(f"by_commit chunk of {year}")
+            chunk_path = f"./data/by_commit.{year}.chunk.parquet"
+            chunks.append(chunk_path)
+            # a range on the dates, so parquet row groups of other years are skipped
+            rows = commits.filter(
+                (pl.col("committer_date") >= datetime(year, 1, 1))
+                & (pl.col("committer_date") < datetime(year + 1, 1, 1))
+            )
+            by_commit_frame(rows, history).sink_parquet(
+                chunk_path, row_group_size=PARQUET_ROW_GROUP_SIZE, engine="streaming"
+            )
+        # the chunks are read back in year order, already sorted by date
+        write_output("by_commit", pl.scan_parquet(chunks))
+    finally:
+        for chunk_path in chunks:
+            if os.path.exists(chunk_path):
+                os.remove(chunk_path)
+
+
+def run_full(history: MaintainersHistory):
+    if STITCH_STREAMING:
+        # the by_commit columns only depend on the commit, so they are computed one
+        # year of commits at a time, each written to disk before the next is read.
+        # the per day aggregation then streams back over the written file
+        logging.info("streaming by_commit ")
+        with instrumentation.phase("write_by_commit"):
+            write_by_commit_chunks(history)
+        by_commit = scan_output("by_commit")
+    else:
+        # attributions are loaded as a list of {type, name, email} structs
+        with instrumentation.phase("read_enhanced"):
+            commits = read_frame("enhanced", ENHANCED_SCHEMA)
+        logging.debug(f"{commits.height} enhanced commits, columns {commits.columns}")
+
+        logging.info("collecting polars operations")
+        df = instrumentation.collect(
+            by_commit_frame(commits.lazy(), history), "by_commit"
+        )
+
+        df = df.sort("committer_date", descending=False)
+
+        logging.info("writing by_commit ")
+        with instrumentation.phase("write_by_commit"):
+            write_output("by_commit", df.lazy())
+        by_commit = df.lazy()
+
+    # only one row per day is kept in memory
+    logging.info("collecting grouped df")
+    df = instrumentation.collect(
+        by_date_frame(by_commit),
+        "by_date",
+        engine="streaming" if STITCH_STREAMING else "auto",
+    )
+    logging.info("collected")
+
+    df = fill_days(df)
+
+    # the shape only, formatting the frame costs more than it tells
+    logging.info(f"writing by_date, {df.height} days")
+    logging.debug(df.columns)
+    with instrumentation.phase("write_by_date"):
+        write_output("by_date", df.lazy())
+
+
+def run():
+    with instrumentation.phase("load_maintainers"):
+        history = MaintainersHistory.load()
+
+    cutoff = incremental_cutoff(history) if STITCH_INCREMENTAL else None
+    if cutoff is not None:
+        run_incremental(history, cutoff)
+    else:
+        run_full(history)
+
+    with instrumentation.phase("rollups"):
+        write_rollups()
+    with instrumentation.phase("contributor_index"):
+        write_contributor_index()
+    with instrumentation.phase("by_tree"):
+        by_tree = write_by_tree()
+
+    last_date = (
+        scan_output("by_commit").select(pl.col("committer_date").max()).collect().item()
+    )
+    files = output_files("by_commit") + output_files("by_date")
+    files += [f"./data/by_{name}.parquet" for name in ROLLUPS]
+    files += ["./data/contributors.parquet", "./data/contributor_gaps.parquet"]
+    if by_tree:
+        files.append("./data/by_tree_date.parquet")
+    with instrumentation.phase("manifest"):
+        manifest = bump_manifest(
+            mode="incremental" if cutoff is not None else "full",
+            schema_version=SCHEMA_VERSION,
+            partitioned=STITCH_PARTITIONED,
+            last_committer_date=last_date.isoformat(),
+            contributor_min_gap_days=CONTRIBUTOR_MIN_GAP_DAYS,
+            datasets={
+                os.path.relpath(path, "./data").removesuffix(
+                    ".parquet"
+                ): describe_parquet(path)
+                for path in files
+            },
+        )
+    logging.info(f"dataset version {manifest['version']}")
 
 
 if __name__ == "__main__":
+    instrumentation.start("stitch")
     run()
@@ -0,0 +1,170 @@
+import os
+import random
+import shutil
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from columnar_io import (
+    ENHANCED_SCHEMA,
+    MAINTAINERS_HISTORY_SCHEMA,
+    MAINTAINERS_SNAPSHOTS_SCHEMA,
+)
+
+# an incremental stitch over commits held back from a full one must give the same
+# outputs as a full stitch over all of them
+# usage: python -m pytest test_stitch_incremental.py
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+COMMITS = 1500
+HELD_BACK = 500
+VERSIONS = 20
+START = datetime(2020, 1, 1)
+
+EMAILS = [f"dev{i}@example.org" for i in range(40)]
+SECTIONS = [f"SUBSYSTEM {i}" for i in range(8)]
+TRAILERS = ["Reviewed-by", "Acked-by", "Tested-by", "Reported-by", "Suggested-by"]
+
+
+def run_stitch(work_dir: str, **env):
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "stitch_data_into_final_payload.py"),
+        ],
+        cwd=work_dir,
+        env=dict(os.environ, OUTPUT_FORMAT="parquet", **env),
+        check=True,
+    )
+
+
+def write_dataset(work_dir: str, name: str, rows: list[dict], schema: pa.Schema):
+    pq.write_table(
+        pa.Table.from_pylist(rows, schema=schema),
+        os.path.join(work_dir, "data", f"{name}.parquet"),
+    )
+
+
+@pytest.fixture(scope="module")
+def enriched(tmp_path_factory) -> str:
+    """work directory with synthetic enhanced and maintainers datasets"""
+    rng = random.Random(0)
+    work_dir = tmp_path_factory.mktemp("stitch")
+    os.makedirs(work_dir / "data")
+
+    def date(i: int, count: int) -> datetime:
+        # three years of history, with a few seconds of jitter between neighbours
+        return START + timedelta(days=3 * 365 * i / count, seconds=rng.randrange(600))
+
+    commits = []
+    for i in range(COMMITS):
+        author, committer = rng.choice(EMAILS), rng.choice(EMAILS[:10])
+        committed = date(i, COMMITS)
+        commits.append(
+            {
+                "commit": f"{i:040x}",
+                "committer_date": committed,
+                "author_date": committed - timedelta(days=rng.randrange(30)),
+                "insertions": rng.randrange(200),
+                "deletions": rng.randrange(100),
+                "author": author,
+                "committer": committer,
+                "attributions": [
+                    {"type": "Signed-off-by", "name": "", "email": author},
+                    *(
+                        {
+                            "type": rng.choice(TRAILERS),
+                            "name": "",
+                            "email": rng.choice(EMAILS),
+                        }
+                        for _ in range(rng.randrange(3))
+                    ),
+                ],
+                "tag": None,
+            }
+        )
+    # crawl order differs from date order, as with merged branches
+    rng.shuffle(commits)
+    write_dataset(work_dir, "enhanced", commits, ENHANCED_SCHEMA)
+
+    entries = {(rng.choice(SECTIONS), email) for email in rng.sample(EMAILS, 12)}
+    history = [
+        {
+            "version": 0,
+            "commit": "m0",
+            "committer_date": START,
+            "added": [{"section": s, "email": e} for s, e in sorted(entries)],
+            "removed": [],
+        }
+    ]
+    snapshots = [{**history[0], "maintainers": history[0]["added"]}]
+    del snapshots[0]["added"], snapshots[0]["removed"]
+    for version in range(1, VERSIONS):
+        added = {(rng.choice(SECTIONS), rng.choice(EMAILS))} - entries
+        removed = set(rng.sample(sorted(entries), 1))
+        entries = (entries - removed) | added
+        history.append(
+            {
+                "version": version,
+                "commit": f"m{version}",
+                "committer_date": date(version, VERSIONS),
+                "added": [{"section": s, "email": e} for s, e in sorted(added)],
+                "removed": [{"section": s, "email": e} for s, e in sorted(removed)],
+            }
+        )
+    write_dataset(work_dir, "maintainers_history", history, MAINTAINERS_HISTORY_SCHEMA)
+    write_dataset(
+        work_dir, "maintainers_snapshots", snapshots, MAINTAINERS_SNAPSHOTS_SCHEMA
+    )
+    return str(work_dir)
+
+
+def normalized(path: str, key: str) -> pl.DataFrame:
+    df = pl.read_parquet(path)
+    return df.with_columns(
+        pl.col(name).list.sort()
+        for name, dtype in df.schema.items()
+        if isinstance(dtype, pl.List) and not dtype.inner.is_nested()
+    ).sort(key)
+
+
+@pytest.mark.parametrize("held_back", ["newest", "middle"])
+def test_incremental_matches_full(enriched, tmp_path, held_back):
+    full_dir = tmp_path / "full"
+    incremental_dir = tmp_path / "incremental"
+    shutil.copytree(enriched, full_dir)
+    shutil.copytree(enriched, incremental_dir)
+    run_stitch(full_dir)
+
+    # the first stitch only sees part of the commits, the newest ones, or a range of
+    # older ones merged late
+    enhanced_path = incremental_dir / "data" / "enhanced.parquet"
+    enhanced = pl.read_parquet(enhanced_path).with_row_index("rank")
+    ranks = enhanced.sort("committer_date")["rank"]
+    if held_back == "newest":
+        held = ranks[-HELD_BACK:]
+    else:
+        held = ranks[COMMITS // 2 - HELD_BACK // 2 : COMMITS // 2 + HELD_BACK // 2]
+    schema = pq.read_schema(enhanced_path)
+    shutil.move(enhanced_path, tmp_path / "enhanced.parquet")
+    pq.write_table(
+        enhanced.filter(~pl.col("rank").is_in(held.implode()))
+        .drop("rank")
+        .to_arrow()
+        .cast(schema),
+        enhanced_path,
+    )
+    run_stitch(incremental_dir)
+
+    shutil.move(tmp_path / "enhanced.parquet", enhanced_path)
+    run_stitch(incremental_dir, STITCH_INCREMENTAL="true")
+
+    for name, key in [("by_commit", "commit"), ("by_date", "committer_date")]:
+        expected = normalized(full_dir / "data" / f"{name}.parquet", key)
+        actual = normalized(incremental_dir / "data" / f"{name}.parquet", key)
+        assert actual.equals(expected), name
@@ -1,9 +1,18 @@
 from flask import Flask, request, jsonify, make_response
-from data_loader import load_data, load_tags
+from data_loader import (
+    COHORT_ROLES,
+    contributor_min_gap_days,
+    dataset_version,
+    load_cohorts,
+    load_data,
+    load_tags,
+    load_trees,
+)
 
 import orjson
 import os
 import logging
+from datetime import datetime
 
 DEBUG = os.getenv("DEBUG", "false")
 level = logging.INFO
@@ -33,11 +42,52 @@ def get_commits():
         if "d" not in window_size:
             window_size = window_size + "d"
 
-        app.logger.info("GET commits with window: %s", window_size)
+        # optional yyyy-mm-dd range, only the data of these dates is read
+        try:
+            start_date, end_date = [
+                (
+                    datetime.fromisoformat(request.args[arg])
+                    if request.args.get(arg)
+                    else None
+                )
+                for arg in ["start_date", "end_date"]
+            ]
+        except ValueError:
+            return jsonify({"error": "dates must be formatted as yyyy-mm-dd"}), 400
+
+        # optional name of a crawled tree, all trees by default
+        tree = request.args.get("tree") or None
+        if tree is not None and tree not in load_trees():
+            return jsonify({"error": f"unknown tree: {tree}"}), 400
+
+        app.logger.info(
+            "GET commits with window: %s, from %s to %s, tree %s",
+            window_size,
+            start_date,
+            end_date,
+            tree,
+        )
 
-        data = load_data(window_date_size=window_size)
+        # the response only changes with the dataset version
+        version = dataset_version()
+        etag = None
+        if version is not None:
+            etag = f"{version}-{window_size}-{start_date}-{end_date}-{tree}".replace(
+                " ", "T"
+            )
+        if etag and etag in request.if_none_match:
+            return "", 304
+
+        data = load_data(
+            window_date_size=window_size,
+            start_date=start_date,
+            end_date=end_date,
+            tree=tree,
+        )
         response = jsonify(data.to_dict(as_series=False))
         response.headers.add("Access-Control-Allow-Origin", "*")
+        if etag:
+            response.set_etag(etag)
         return response
     else:
         raise RuntimeError(
@@ -45,6 +95,55 @@ def get_commits():
         )
 
 
+@app.route("/api/cohorts", methods=["GET"])
+def get_cohorts():
+    """
+    Endpoint to serve the new, returning and churned contributors over a window.
+    """
+    window_size = request.args.get("window_size", "30d")
+    if "d" not in window_size:
+        window_size = window_size + "d"
+
+    try:
+        start_date, end_date = [
+            datetime.fromisoformat(request.args[arg]) if request.args.get(arg) else None
+            for arg in ["start_date", "end_date"]
+        ]
+    except ValueError:
+        return jsonify({"error": "dates must be formatted as yyyy-mm-dd"}), 400
+
+    role = request.args.get("role", "all_contributors")
+    if role not in COHORT_ROLES:
+        return jsonify({"error": f"unknown role: {role}"}), 400
+
+    # absences shorter than the one indexed by the stitch stage were not recorded
+    gap_days = request.args.get("gap_days", "90")
+    min_gap_days = contributor_min_gap_days() or 0
+    if not gap_days.isdigit() or int(gap_days) < min_gap_days:
+        return jsonify({"error": f"gap_days must be at least {min_gap_days}"}), 400
+
+    version = dataset_version()
+    etag = None
+    if version is not None:
+        etag = f"{version}-{window_size}-{role}-{gap_days}-{start_date}-{end_date}"
+        etag = etag.replace(" ", "T")
+    if etag and etag in request.if_none_match:
+        return "", 304
+
+    data = load_cohorts(
+        window_date_size=window_size,
+        role=role,
+        gap_days=int(gap_days),
+        start_date=start_date,
+        end_date=end_date,
+    )
+    response = jsonify(data.to_dict(as_series=False))
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
 @app.route("/api/tags", methods=["GET"])
 def get_tags():
     """
@@ -63,6 +162,16 @@ def get_tags():
         )
 
 
+@app.route("/api/trees", methods=["GET"])
+def get_trees():
+    """
+    Endpoint listing the trees /api/commits can be filtered on.
+    """
+    response = jsonify(load_trees())
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    return response
+
+
 @app.route("/")
 def home():
     return app.send_static_file("index.html")
@@ -1,10 +1,91 @@
+import os
+from datetime import datetime, timedelta
+
+import orjson
 import polars as pl
 
 
-def load_by_commits(window_date_size=None):
-    df = pl.read_parquet("../data/by_commit.parquet")
+def _read_dataset(name: str, json_columns: dict | None = None) -> pl.DataFrame:
+    # the scripts write either parquet or pipe separated csv, with list columns as json
+    if os.path.exists(f"../data/{name}.parquet"):
+        return pl.read_parquet(f"../data/{name}.parquet")
+    df = pl.read_csv(f"../data/{name}.csv", separator="|")
+    return df.with_columns(
+        [
+            pl.col(column).str.json_decode(dtype=dtype)
+            for column, dtype in (json_columns or {}).items()
+        ]
+    )
+
 
-    return df
+# the stitch stage writes either single files or year partitions (STITCH_PARTITIONED)
+def _scan_output(name: str) -> pl.LazyFrame:
+    if os.path.isdir(f"../data/{name}"):
+        return pl.scan_parquet(
+            f"../data/{name}/year=*/*.parquet", hive_partitioning=True
+        )
+    return pl.scan_parquet(f"../data/{name}.parquet")
+
+
+# rows from start_date to end_date (inclusive), the partitions of other years are not read
+def _between(
+    df: pl.LazyFrame, start_date: datetime | None, end_date: datetime | None
+) -> pl.LazyFrame:
+    partitioned = "year" in df.collect_schema().names()
+    if start_date is not None:
+        if partitioned:
+            df = df.filter(pl.col("year") >= start_date.year)
+        df = df.filter(pl.col("committer_date") >= start_date)
+    if end_date is not None:
+        if partitioned:
+            df = df.filter(pl.col("year") <= end_date.year)
+        df = df.filter(pl.col("committer_date") < end_date + timedelta(days=1))
+    return df.drop("year") if partitioned else df
+
+
+def _manifest() -> dict:
+    try:
+        with open("../data/manifest.json", "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return {}
+
+
+# version of the datasets, bumped by the stitch stage on every write.
+# cheap to check, so clients can be told nothing changed without loading anything
+def dataset_version() -> int | None:
+    return _manifest().get("version")
+
+
+# shortest absence recorded in contributor_gaps, load_cohorts can't use shorter gaps
+def contributor_min_gap_days() -> int | None:
+    return _manifest().get("contributor_min_gap_days")
+
+
+# commits that touched at least one path starting with path_prefix, e.g. "drivers/gpu/"
+def commits_touching(path_prefix: str) -> pl.DataFrame:
+    paths = _read_dataset("paths")
+    ids = paths.filter(pl.col("path").str.starts_with(path_prefix))["path_id"]
+
+    commit_paths = _read_dataset("commit_paths", {"path_ids": pl.List(pl.UInt32)})
+    return (
+        commit_paths.explode("path_ids")
+        .filter(pl.col("path_ids").is_in(ids))
+        .select("commit")
+        .unique()
+    )
+
+
+def load_by_commits(
+    window_date_size=None, path_prefix=None, start_date=None, end_date=None
+):
+    # scanned, filters are pushed down to the partitions and row groups
+    df = _between(_scan_output("by_commit"), start_date, end_date)
+
+    if path_prefix:
+        df = df.join(commits_touching(path_prefix).lazy(), on="commit", how="semi")
+
+    return df.collect()
 
 
 # short-hand for appliying the rolling_count
@@ -19,12 +100,26 @@ def rolling_count_row_of_lists(
     )
 
 
-def load_data(window_date_size="1d"):
-    df = pl.read_parquet("../data/by_date.parquet").lazy()
-
+def load_data(window_date_size="1d", start_date=None, end_date=None, tree=None):
     if window_date_size is None:
         window_date_size = "1d"
 
+    # the rolling counts at start_date need the days of the window before it
+    read_from = start_date
+    if start_date is not None:
+        read_from = pl.select(
+            pl.lit(start_date).dt.offset_by(f"-{window_date_size}")
+        ).item()
+    by_date = _scan_output("by_date")
+    # the days of a single tree, when several were crawled together
+    if tree is not None and os.path.exists("../data/by_tree_date.parquet"):
+        by_date = (
+            pl.scan_parquet("../data/by_tree_date.parquet")
+            .filter(pl.col("tree") == tree)
+            .drop("tree")
+        )
+    df = _between(by_date, read_from, end_date)
+
     # count number of total contributors over the windw_date_size period
     df = df.with_columns(
         [
@@ -92,6 +187,9 @@ def load_data(window_date_size="1d"):
         "extra_contributors",
     )
 
+    if start_date is not None:
+        df = df.filter(pl.col("committer_date") >= start_date)
+
     # send date as yyyy-mm-dd
     df = df.with_columns(
         pl.col("committer_date").dt.strftime("%Y-%m-%d").alias("committer_date")
@@ -100,13 +198,117 @@ def load_data(window_date_size="1d"):
     return df.collect()
 
 
+# contributor columns of by_date indexed in contributors and contributor_gaps
+COHORT_ROLES = [
+    "author",
+    "committer",
+    "extra_contributors",
+    "all_contributors",
+    "author_in_maintainers_file",
+    "committer_in_maintainers_file",
+    "extra_attributions_in_maintainers_file",
+    "attributions_ack",
+    "attributions_reviewed",
+    "attributions_reported",
+    "attributions_suggested",
+    "attributions_tested",
+]
+
+
+def load_cohorts(
+    window_date_size="30d",
+    role="all_contributors",
+    gap_days=90,
+    start_date=None,
+    end_date=None,
+):
+    """
+    Counts of contributors of a role over the window_date_size days up to each day:
+    new_contributors, seen for the first time
+    returning_contributors, seen again after at least gap_days days
+    churned_contributors, seen for the last time before at least gap_days days, only
+    counted once these days have passed
+    Read from the first seen index and the absences written by the stitch stage.
+    """
+    contributors = pl.scan_parquet("../data/contributors.parquet").filter(
+        pl.col("role") == role
+    )
+    gaps = pl.scan_parquet("../data/contributor_gaps.parquet").filter(
+        pl.col("role") == role, pl.col("gap_days") >= gap_days
+    )
+    days = (
+        _scan_output("by_date")
+        .select(pl.col("committer_date").dt.date().alias("day"))
+        .collect()
+    )
+    last_day = days["day"].max()
+
+    new = contributors.group_by(pl.col("first_seen").alias("day")).agg(
+        new_contributors=pl.len()
+    )
+    returning = gaps.group_by(pl.col("returned_on").alias("day")).agg(
+        returning_contributors=pl.len()
+    )
+    churned = (
+        pl.concat(
+            [
+                gaps.select(pl.col("left_on").alias("day")),
+                # not seen again up to the last day
+                contributors.filter(
+                    pl.col("last_seen") <= last_day - timedelta(days=gap_days)
+                ).select(pl.col("last_seen").alias("day")),
+            ]
+        )
+        .group_by("day")
+        .agg(churned_contributors=pl.len())
+    )
+
+    counts = ["new_contributors", "returning_contributors", "churned_contributors"]
+    df = days.lazy()
+    for daily in [new, returning, churned]:
+        df = df.join(daily, on="day", how="left")
+    df = (
+        df.with_columns(pl.col(counts).fill_null(0))
+        .sort("day")
+        .with_columns(pl.col(counts).rolling_sum_by("day", window_date_size))
+    )
+
+    if start_date is not None:
+        df = df.filter(pl.col("day") >= start_date.date())
+    if end_date is not None:
+        df = df.filter(pl.col("day") <= end_date.date())
+
+    # send date as yyyy-mm-dd
+    return df.select(
+        pl.col("day").dt.strftime("%Y-%m-%d").alias("committer_date"), *counts
+    ).collect()
+
+
+# names of the trees crawled together (KERNEL_TREES), that load_data can filter on
+def load_trees() -> list[str]:
+    if not any(os.path.exists(f"../data/trees.{ext}") for ext in ["parquet", "csv"]):
+        return []
+    return _read_dataset("trees")["name"].to_list()
+
+
 # TODO: there are missing tags
 def load_tags():
-    df = pl.read_csv(
-        "../data/tags.csv",
-        separator="|",
-        infer_schema=False,  # try_parse_dates=True
-    )
+    # tags are written as parquet when the scripts run with OUTPUT_FORMAT=parquet
+    if os.path.exists("../data/tags.parquet"):
+        df = pl.read_parquet("../data/tags.parquet").with_columns(
+            pl.col("date").dt.strftime("%Y-%m-%d %H:%M:%S")
+        )
+    elif os.path.exists("../data/tags.csv"):
+        df = pl.read_csv(
+            "../data/tags.csv",
+            separator="|",
+            infer_schema=False,  # try_parse_dates=True
+        )
+    else:
+        # only written by enrich_from_git.py with LOAD_TAGS_FROM_REPO
+        df = pl.DataFrame(
+            schema={"tag": pl.String, "commit": pl.String, "date": pl.String}
+        )
 
     # TODO: change order ?
     # df = df.sort(
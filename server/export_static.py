@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+
+import orjson
+
+from data_loader import dataset_version, load_data, load_tags
+
+DEBUG = os.getenv("DEBUG", "false")
+level = logging.INFO
+if DEBUG != "false":
+    level = logging.DEBUG
+
+logging.basicConfig(
+    level=level,
+    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+# served by nginx under /static/data, and by flask in development
+EXPORT_DIR = os.getenv("EXPORT_DIR", "./static/data")
+# the window sizes offered by the dashboard (index.html)
+EXPORT_WINDOWS = os.getenv("EXPORT_WINDOWS", "1d,5d,14d,30d,60d,120d,365d").split(",")
+# previous versions kept, for clients that loaded latest.json before this export
+EXPORT_KEEP = int(os.getenv("EXPORT_KEEP", "1"))
+# exports again even if latest.json already points to the dataset version
+EXPORT_FORCE = os.getenv("EXPORT_FORCE", "false") != "false"
+
+
+def write_payload(directory: str, name: str, payload: bytes):
+    """writes name.json and its precompressed .gz, served by nginx gzip_static"""
+    path = os.path.join(directory, f"{name}.json")
+    with open(path, "wb") as f:
+        f.write(payload)
+    with open(f"{path}.gz", "wb") as f:
+        f.write(gzip.compress(payload, compresslevel=9, mtime=0))
+
+
+def read_latest() -> dict | None:
+    try:
+        with open(os.path.join(EXPORT_DIR, "latest.json"), "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def export():
+    version = dataset_version()
+    latest = read_latest()
+    if (
+        not EXPORT_FORCE
+        and version is not None
+        and latest is not None
+        and latest["version"] == version
+        and latest["windows"] == EXPORT_WINDOWS
+    ):
+        logging.info(f"version {version} is already exported")
+        return
+
+    payloads = {
+        f"commits_{window}": orjson.dumps(
+            load_data(window_date_size=window).to_dict(as_series=False)
+        )
+        for window in EXPORT_WINDOWS
+    }
+    payloads["tags"] = orjson.dumps(load_tags().to_dicts())
+
+    # without a manifest the payloads are versioned by their contents
+    if version is None:
+        digest = hashlib.sha256()
+        for name in sorted(payloads):
+            digest.update(payloads[name])
+        version = digest.hexdigest()[:12]
+
+    # written aside and renamed, a version directory is complete once it exists
+    directory = f"v{version}"
+    staging = os.path.join(EXPORT_DIR, f"{directory}.staging")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, payload in payloads.items():
+        write_payload(staging, name, payload)
+        logging.info(f"{directory}/{name}.json: {len(payload) / 1024:.0f} KiB")
+    shutil.rmtree(os.path.join(EXPORT_DIR, directory), ignore_errors=True)
+    os.replace(staging, os.path.join(EXPORT_DIR, directory))
+
+    # latest.json is swapped last, clients never see a version before its files
+    latest_path = os.path.join(EXPORT_DIR, "latest.json")
+    with open(f"{latest_path}.tmp", "wb") as f:
+        f.write(
+            orjson.dumps(
+                {"version": version, "path": directory, "windows": EXPORT_WINDOWS}
+            )
+        )
+    os.replace(f"{latest_path}.tmp", latest_path)
+
+    # older versions, oldest first
+    previous = sorted(
+        (
+            entry
+            for entry in os.scandir(EXPORT_DIR)
+            if entry.is_dir() and entry.name.startswith("v") and entry.name != directory
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in previous[: max(len(previous) - EXPORT_KEEP, 0)]:
+        logging.info(f"removing {entry.name}")
+        shutil.rmtree(entry.path)
+    logging.info(f"exported version {version} to {EXPORT_DIR}/{directory}")
+
+
+if __name__ == "__main__":
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    export()
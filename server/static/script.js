@@ -1,4 +1,34 @@
+// payloads precomputed by export_static.py, the api is used when they are missing
+let staticExport = null;
+async function getStaticExport(){
+    if (staticExport === null) {
+        try {
+            const result = await fetch("/static/data/latest.json", {cache: "no-cache"})
+            staticExport = result.ok ? await result.json() : false
+        } catch (error) {
+            staticExport = false
+        }
+    }
+    return staticExport
+}
+
+async function getStaticPayload(name){
+    const exported = await getStaticExport()
+    if (!exported) {
+        return null
+    }
+    const result = await fetch(`/static/data/${exported.path}/${name}.json`)
+    return result.ok ? await result.json() : null
+}
+
 async function get_commits(window_size){
+    const exported = await getStaticExport()
+    if (exported && exported.windows.includes(`${window_size}d`)) {
+        const json_commits = await getStaticPayload(`commits_${window_size}d`)
+        if (json_commits !== null) {
+            return json_commits
+        }
+    }
 		result = await fetch(`/api/commits?window_size=${window_size}`)
     json_commits = await result.json()
 
@@ -6,6 +36,10 @@ async function get_commits(window_size){
 }
 
 async function getTags(){
+    const staticTags = await getStaticPayload("tags")
+    if (staticTags !== null) {
+        return staticTags
+    }
     result = await fetch("/api/tags")
     jsonTags = await result.json()
     return jsonTags